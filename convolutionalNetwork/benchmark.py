@@ -0,0 +1,417 @@
+"""
+Microbenchmarks of the NumPy kernels of utils.py: zero_pad, conv_forward, conv_backward, pool_forward and pool_backward.
+
+Every kernel runs on a matrix of layer shapes (the FashionMNIST networks of this repository and the stages of
+keras/fashionMnist/residualNetwork.py) and is reported with its wall time, its effective GFLOP/s and the peak
+memory it allocates. Every result is also checked against the loop reference implementation on the first
+examples of the batch.
+
+Usage:
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json     # exits with status 1 if a kernel got slower than --threshold
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import utils
+from utils import *
+
+
+"""
+SHAPES
+"""
+# (name, m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad, dilation, groups)
+CONV_CASES = [
+    ("fashion_conv1", 64, 28, 28, 1, 3, 8, 1, 1, 1, 1),
+    ("fashion_conv2", 64, 10, 10, 8, 2, 16, 1, 0, 1, 1),
+    ("keras_conv5x5", 64, 28, 28, 6, 5, 6, 1, 2, 1, 1),
+    ("resnet_conv1", 16, 64, 64, 3, 7, 64, 2, 3, 1, 1),
+    ("resnet_stage2_3x3", 16, 15, 15, 64, 3, 64, 1, 1, 1, 1),
+    ("resnet_stage2_1x1", 16, 15, 15, 64, 1, 256, 1, 0, 1, 1),
+    ("resnet_stage3_1x1_s2", 16, 15, 15, 256, 1, 128, 2, 0, 1, 1),
+    ("resnet_stage3_3x3", 16, 8, 8, 128, 3, 128, 1, 1, 1, 1),
+    ("resnet_stage4_3x3", 16, 4, 4, 256, 3, 256, 1, 1, 1, 1),
+    ("grouped_3x3", 16, 15, 15, 64, 3, 64, 1, 1, 1, 8),
+    ("depthwise_3x3", 16, 15, 15, 64, 3, 64, 1, 1, 1, 64),
+    ("dilated_3x3", 16, 15, 15, 64, 3, 64, 1, 2, 2, 1),
+]
+
+# (name, m, n_H_prev, n_W_prev, n_C, f, stride, mode)
+POOL_CASES = [
+    ("fashion_pool1", 64, 30, 30, 8, 3, 3, "max"),
+    ("fashion_pool2", 64, 12, 12, 16, 3, 3, "max"),
+    ("keras_pool2x2", 64, 28, 28, 6, 2, 2, "max"),
+    ("resnet_pool1", 16, 32, 32, 64, 3, 2, "max"),
+    ("resnet_avgpool", 16, 4, 4, 2048, 2, 2, "average"),
+    ("overlap_avgpool", 64, 28, 28, 8, 3, 1, "average"),
+]
+
+# (name, m, n_H, n_W, n_C, pad)
+PAD_CASES = [
+    ("fashion_input", 64, 28, 28, 1, 1),
+    ("keras_input", 64, 28, 28, 1, 2),
+    ("resnet_input", 16, 64, 64, 3, 3),
+    ("resnet_stage2", 16, 15, 15, 64, 1),
+]
+
+
+"""
+MEASURES
+"""
+def measure(function, repeat):
+    """
+    Runs function() once to warm up, then repeat times.
+
+    Returns:
+    times -- list of the wall times, in seconds
+    peak_memory -- peak of the memory allocated by one call, in bytes
+    """
+
+    function()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    # A separate call, tracemalloc slows the allocations down
+    tracemalloc.start()
+    try:
+        function()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return times, peak_memory
+
+
+def relative_error(result, reference):
+    """
+    Largest absolute difference, relative to the largest entry of the reference.
+    """
+
+    scale = max(float(np.max(np.abs(reference))), 1e-30)
+
+    return float(np.max(np.abs(np.asarray(result, dtype=np.float64) - reference)))/scale
+
+
+def tolerance(dtype):
+    return 1e-4 if np.dtype(dtype) == np.float32 else 1e-9
+
+
+def record(kernel, name, algorithm, shape, dtype, times, peak_memory, flops, error):
+    best = min(times)
+
+    return {"kernel": kernel,
+            "case": name,
+            "algorithm": algorithm,
+            "shape": shape,
+            "dtype": np.dtype(dtype).name,
+            "best_s": best,
+            "median_s": float(np.median(times)),
+            "gflops": flops/best/1e9 if flops else None,
+            "peak_memory_bytes": peak_memory,
+            "max_relative_error": error,
+            "ok": error <= tolerance(dtype)}
+
+
+"""
+BENCHMARKS
+"""
+def bench_zero_pad(rng, dtype, repeat, check_size):
+    results = []
+    for (name, m, n_H, n_W, n_C, pad) in PAD_CASES:
+        X = rng.randn(m, n_H, n_W, n_C).astype(dtype)
+        shape = {"m": m, "n_H": n_H, "n_W": n_W, "n_C": n_C, "pad": pad}
+
+        reference = np.pad(X[:check_size], ((0, 0), (pad, pad), (pad, pad), (0, 0)), "constant")
+        error = relative_error(zero_pad(X, pad)[:check_size], reference)
+        times, peak_memory = measure(lambda: zero_pad(X, pad), repeat)
+        results.append(record("zero_pad", name, "np.pad", shape, dtype, times, peak_memory, 0, error))
+
+        out = np.zeros((m, n_H + 2*pad, n_W + 2*pad, n_C), dtype=dtype)
+        error = relative_error(zero_pad(X, pad, out=out)[:check_size], reference)
+        times, peak_memory = measure(lambda: zero_pad(X, pad, out=out), repeat)
+        results.append(record("zero_pad", name, "out", shape, dtype, times, peak_memory, 0, error))
+
+    return results
+
+
+def bench_conv(rng, dtype, repeat, check_size, n_jobs, use_workspace, memory_budget=None):
+    results = []
+    for (name, m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad, dilation, groups) in CONV_CASES:
+        n_C_group = n_C_prev//groups
+        A_prev = rng.randn(m, n_H_prev, n_W_prev, n_C_prev).astype(dtype)
+        W = (rng.randn(f, f, n_C_group, n_C)/np.sqrt(f*f*n_C_group)).astype(dtype)
+        b = rng.randn(1, 1, 1, n_C).astype(dtype)
+        hparameters = {"stride": stride, "pad": pad, "dilation": dilation, "groups": groups}
+        f_dilated = (f - 1)*dilation + 1
+        n_H = int((n_H_prev - f_dilated + 2*pad)/stride) + 1
+        n_W = int((n_W_prev - f_dilated + 2*pad)/stride) + 1
+        dZ = rng.randn(m, n_H, n_W, n_C).astype(dtype)
+        shape = {"m": m, "n_H_prev": n_H_prev, "n_W_prev": n_W_prev, "n_C_prev": n_C_prev,
+                 "f": f, "n_C": n_C, "stride": stride, "pad": pad, "dilation": dilation, "groups": groups}
+        # One multiply-add per filter weight and output value
+        flops = 2.0*m*n_H*n_W*n_C*f*f*n_C_group
+
+        small_cache = (A_prev[:check_size], W, b, hparameters)
+        Z_reference = conv_forward(A_prev[:check_size], W, b, hparameters, algorithm="loop")[0]
+        dA_reference, dW_reference, db_reference = conv_backward(dZ[:check_size], small_cache, algorithm="loop")
+
+        for algorithm in conv_forward_candidates(f, stride, dilation, groups):
+            workspace = Workspace() if use_workspace else None
+            function = lambda: conv_forward(A_prev, W, b, hparameters, algorithm, workspace, n_jobs, memory_budget)
+            Z = conv_forward(A_prev[:check_size], W, b, hparameters, algorithm, workspace, n_jobs, memory_budget)[0]
+            error = relative_error(Z, Z_reference)
+            times, peak_memory = measure(function, repeat)
+            results.append(record("conv_forward", name, algorithm, shape, dtype, times, peak_memory, flops, error))
+
+        cache = (A_prev, W, b, hparameters)
+        for algorithm in conv_backward_candidates(f, stride, dilation, groups):
+            workspace = Workspace() if use_workspace else None
+            function = lambda: conv_backward(dZ, cache, algorithm, workspace, n_jobs, memory_budget)
+            dA_prev, dW, db = conv_backward(dZ[:check_size], small_cache, algorithm, workspace, n_jobs, memory_budget)
+            error = max(relative_error(dA_prev, dA_reference), relative_error(dW, dW_reference),
+                        relative_error(db, db_reference))
+            times, peak_memory = measure(function, repeat)
+            # dA_prev and dW, each as expensive as the forward pass
+            results.append(record("conv_backward", name, algorithm, shape, dtype, times, peak_memory, 2*flops, error))
+
+    return results
+
+
+def bench_pool(rng, dtype, repeat, check_size, n_jobs, use_workspace):
+    results = []
+    for (name, m, n_H_prev, n_W_prev, n_C, f, stride, mode) in POOL_CASES:
+        A_prev = rng.randn(m, n_H_prev, n_W_prev, n_C).astype(dtype)
+        hparameters = {"f": f, "stride": stride}
+        n_H = int(1 + (n_H_prev - f)/stride)
+        n_W = int(1 + (n_W_prev - f)/stride)
+        dA = rng.randn(m, n_H, n_W, n_C).astype(dtype)
+        shape = {"m": m, "n_H_prev": n_H_prev, "n_W_prev": n_W_prev, "n_C": n_C, "f": f, "stride": stride}
+        # One comparison (or addition) per window entry
+        flops = 1.0*m*n_H*n_W*n_C*f*f
+
+        A_reference, small_cache = pool_forward(A_prev[:check_size], hparameters, mode, algorithm="loop")
+        dA_prev_reference = pool_backward(dA[:check_size], small_cache, mode, algorithm="loop")
+
+        # Max pooling is timed with and without the argmax cache, f == stride only reshapes without it
+        for cache_argmax in ((True, False) if mode == "max" else (False,)):
+            label = "max-noargmax" if mode == "max" and not cache_argmax else mode
+
+            workspace = Workspace() if use_workspace else None
+            function = lambda: pool_forward(A_prev, hparameters, mode, "strided", cache_argmax, workspace, n_jobs)
+            A, cache = pool_forward(A_prev[:check_size], hparameters, mode, "strided", cache_argmax, workspace, n_jobs)
+            error = relative_error(A, A_reference)
+            times, peak_memory = measure(function, repeat)
+            results.append(record("pool_forward", name, label, shape, dtype, times, peak_memory, flops, error))
+
+            workspace = Workspace() if use_workspace else None
+            error = relative_error(pool_backward(dA[:check_size], cache, mode, "scatter", workspace, n_jobs),
+                                   dA_prev_reference)
+            cache = pool_forward(A_prev, hparameters, mode, "strided", cache_argmax)[1]
+            function = lambda: pool_backward(dA, cache, mode, "scatter", workspace, n_jobs)
+            times, peak_memory = measure(function, repeat)
+            results.append(record("pool_backward", name, label, shape, dtype, times, peak_memory, flops, error))
+
+        if mode == "max":
+            # uint8 images are pooled in float32, the max values are read back from the argmax
+            A_uint8 = rng.randint(0, 256, A_prev.shape).astype(np.uint8)
+            A_uint8_reference = pool_forward(A_uint8[:check_size].astype(np.float32), hparameters, mode, algorithm="loop")[0]
+            workspace = Workspace() if use_workspace else None
+            function = lambda: pool_forward(A_uint8, hparameters, mode, "strided", True, workspace, n_jobs)
+            A = pool_forward(A_uint8[:check_size], hparameters, mode, "strided", True, workspace, n_jobs)[0]
+            error = relative_error(A, A_uint8_reference)
+            times, peak_memory = measure(function, repeat)
+            results.append(record("pool_forward", name, "max-uint8", shape, np.uint8, times, peak_memory, flops, error))
+
+    return results
+
+
+def bench_sparse(rng, dtype, repeat, check_size, densities=(0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 1.0)):
+    """
+    Times the sparse and the col2im backward passes for a range of densities of nonzero output pixels in dZ,
+    to measure the crossovers of SPARSE_DENSITY_THRESHOLDS. The switch of col2im to the sparse pass is disabled
+    during the sweep, so the col2im rows always time the dense pass.
+    """
+
+    results = []
+    thresholds = utils.SPARSE_DENSITY_THRESHOLDS
+    utils.SPARSE_DENSITY_THRESHOLDS = ()
+    try:
+        for (name, m, n_H_prev, n_W_prev, n_C_prev, f, n_C, stride, pad, dilation, groups) in CONV_CASES:
+            if f == 1:
+                continue
+            n_C_group = n_C_prev//groups
+            A_prev = rng.randn(m, n_H_prev, n_W_prev, n_C_prev).astype(dtype)
+            W = (rng.randn(f, f, n_C_group, n_C)/np.sqrt(f*f*n_C_group)).astype(dtype)
+            b = rng.randn(1, 1, 1, n_C).astype(dtype)
+            hparameters = {"stride": stride, "pad": pad, "dilation": dilation, "groups": groups}
+            Z, cache = conv_forward(A_prev, W, b, hparameters)
+            small_cache = (A_prev[:check_size], W, b, hparameters)
+            flops = 4.0*Z.size*f*f*n_C_group
+
+            for density in densities:
+                # Whole pixels are zero, like the background of the images or the pixels a max pooling did not pick
+                dZ = rng.randn(*Z.shape).astype(dtype)*(rng.rand(*Z.shape[:3] + (1,)) < density)
+                shape = {"m": m, "n_H_prev": n_H_prev, "n_W_prev": n_W_prev, "n_C_prev": n_C_prev, "f": f, "n_C": n_C,
+                         "stride": stride, "pad": pad, "dilation": dilation, "groups": groups, "density": density}
+                reference = conv_backward(dZ[:check_size], small_cache, algorithm="loop")
+                for algorithm in ("col2im", "sparse"):
+                    gradients = conv_backward(dZ[:check_size], small_cache, algorithm)
+                    error = max(relative_error(gradient, expected) for (gradient, expected) in zip(gradients, reference))
+                    times, peak_memory = measure(lambda: conv_backward(dZ, cache, algorithm), repeat)
+                    results.append(record("conv_backward", name, "%s@%.2f" % (algorithm, density), shape, dtype,
+                                          times, peak_memory, flops, error))
+    finally:
+        utils.SPARSE_DENSITY_THRESHOLDS = thresholds
+
+    return results
+
+
+def sparse_crossovers(results):
+    """
+    Highest density at which the sparse backward pass is still faster than col2im, for every case of bench_sparse().
+
+    Returns:
+    crossovers -- dictionary case -> density (0 if sparse is never faster)
+    """
+
+    times = {}
+    for result in results:
+        (algorithm, density) = result["algorithm"].split("@")
+        times.setdefault(result["case"], {}).setdefault(float(density), {})[algorithm] = result["best_s"]
+
+    crossovers = {}
+    for (case, by_density) in times.items():
+        faster = [density for (density, time_of) in by_density.items() if time_of["sparse"] < time_of["col2im"]]
+        crossovers[case] = max(faster) if faster else 0.
+
+    return crossovers
+
+
+"""
+REPORT
+"""
+def result_key(result):
+    return (result["kernel"], result["case"], result["algorithm"], result["dtype"])
+
+
+def print_report(results):
+    print("%-14s %-22s %-12s %10s %10s %12s %10s %s" % ("kernel", "case", "algorithm", "best ms", "GFLOP/s",
+                                                       "peak MB", "rel err", "ok"))
+    for result in results:
+        gflops = "%10.2f" % result["gflops"] if result["gflops"] is not None else "%10s" % "-"
+        print("%-14s %-22s %-12s %10.3f %s %12.2f %10.1e %s" % (result["kernel"], result["case"], result["algorithm"],
+                                                           result["best_s"]*1e3, gflops,
+                                                           result["peak_memory_bytes"]/2.**20,
+                                                           result["max_relative_error"], result["ok"]))
+
+
+def compare(results, baseline_results, threshold):
+    """
+    Lists the results whose best time is more than threshold times the best time of the same kernel,
+    case, algorithm and dtype in baseline_results.
+
+    Returns:
+    regressions -- list of (result, ratio)
+    """
+
+    baseline = dict((result_key(result), result) for result in baseline_results)
+    regressions = []
+    for result in results:
+        previous = baseline.get(result_key(result))
+        if previous is None:
+            continue
+        ratio = result["best_s"]/previous["best_s"]
+        if ratio > threshold:
+            regressions.append((result, ratio))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--kernels', help='comma separated list of zero_pad, conv, pool and sparse (density sweep of the sparse conv backward)',
+                        default='zero_pad,conv,pool')
+    parser.add_argument('--dtype', help='float32 or float64', default='float32')
+    parser.add_argument('--repeat', help='number of timed runs of every kernel', default=5)
+    parser.add_argument('--check_size', help='number of examples checked against the loop reference', default=2)
+    parser.add_argument('--n_jobs', help='number of threads of the kernels, -1 for every core', default=1)
+    parser.add_argument('--workspace', help='run the kernels with a Workspace', action='store_true')
+    parser.add_argument('--memory_budget', help='memory budget of the tiled convolutions in MB, 0 for no tiles', default=0)
+    parser.add_argument('--seed', help='seed of the random inputs', default=0)
+    parser.add_argument('--output', help='path of the JSON results', default='')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with', default='')
+    parser.add_argument('--threshold', help='slowdown ratio reported as a regression', default=1.2)
+    args = parser.parse_args()
+
+    dtype = np.dtype(args.dtype)
+    repeat = int(args.repeat)
+    check_size = int(args.check_size)
+    n_jobs = int(args.n_jobs)
+    kernels = args.kernels.split(',')
+    memory_budget = int(float(args.memory_budget)*2**20) or None
+    rng = np.random.RandomState(int(args.seed))
+
+    results = []
+    if 'zero_pad' in kernels:
+        results += bench_zero_pad(rng, dtype, repeat, check_size)
+    if 'conv' in kernels:
+        results += bench_conv(rng, dtype, repeat, check_size, n_jobs, args.workspace, memory_budget)
+    if 'pool' in kernels:
+        results += bench_pool(rng, dtype, repeat, check_size, n_jobs, args.workspace)
+    crossovers = None
+    if 'sparse' in kernels:
+        sparse_results = bench_sparse(rng, dtype, repeat, check_size)
+        crossovers = sparse_crossovers(sparse_results)
+        results += sparse_results
+
+    print_report(results)
+    if crossovers is not None:
+        # Filter shape of every case, the key of sparse_density_threshold()
+        W_shapes = dict((case[0], (case[5], case[5], case[4]//case[10], case[6])) for case in CONV_CASES)
+        for (case, density) in sorted(crossovers.items()):
+            threshold = sparse_density_threshold(W_shapes[case])
+            print("sparse conv_backward faster up to density %.2f on %s (threshold %.2f%s)"
+                  % (density, case, threshold, ", above the crossover" if threshold > density else ""))
+
+    run = {"metadata": {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                        "python": platform.python_version(),
+                        "numpy": np.__version__,
+                        "machine": platform.machine(),
+                        "cpu_count": os.cpu_count(),
+                        "dtype": dtype.name,
+                        "repeat": repeat,
+                        "n_jobs": n_jobs,
+                        "workspace": args.workspace,
+                        "memory_budget": memory_budget},
+           "results": results}
+    if crossovers is not None:
+        run["sparse_crossovers"] = crossovers
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=2)
+
+    status = 0
+    if not all(result["ok"] for result in results):
+        print("Some kernels do not match the loop reference")
+        status = 1
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline_results = json.load(f)["results"]
+        for (result, ratio) in compare(results, baseline_results, float(args.threshold)):
+            print("Regression: %s %s %s %.2fx slower" % (result["kernel"], result["case"], result["algorithm"], ratio))
+            status = 1
+
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
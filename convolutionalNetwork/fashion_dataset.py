@@ -0,0 +1,249 @@
+"""
+fashion-mnist dataset shared by the NumPy, TensorFlow and Keras models: the csv is parsed once into a uint8
+.npy cache that is memory-mapped by the next loads, random subsets are drawn by reservoir sampling over the
+memmap, and the images are normalized one minibatch at a time.
+"""
+import os
+import sys
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    sha1 of the whole file, read in chunks of chunk_size bytes
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+
+def count_rows(csv_path, chunk_size=1 << 20):
+    """
+    Number of data rows of a csv, its lines minus the header
+    """
+    lines = 0
+    last = b'\n'
+    with open(csv_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+
+    # a last row without a trailing newline is still a row
+    return lines - 1 + (last != b'\n')
+
+
+def convert_dataset(csv_path, images_path, labels_path, chunk_rows=4096):
+    """
+    Parses a fashion-mnist csv (label + 28*28 pixels per row) once and writes it as
+    uint8 images of shape (m, 784) and uint8 labels of shape (m,) in .npy files.
+    The csv is read chunk_rows rows at a time and the pixel columns of each chunk are
+    copied straight into the memory-mapped output, so the parse never holds more than
+    one chunk besides the output. The files are written under a temporary name and
+    renamed, so a killed conversion never leaves a half written cache behind.
+    """
+    m = count_rows(csv_path)
+    images = np.lib.format.open_memmap(images_path + '.tmp', mode='w+', dtype=np.uint8, shape=(m, 784))
+    labels = np.lib.format.open_memmap(labels_path + '.tmp', mode='w+', dtype=np.uint8, shape=(m,))
+
+    start = 0
+    for chunk in pd.read_csv(csv_path, dtype=np.uint8, chunksize=chunk_rows):
+        rows = chunk.values
+        labels[start : start + rows.shape[0]] = rows[:, 0]
+        images[start : start + rows.shape[0]] = rows[:, 1:]
+        start += rows.shape[0]
+    if start != m:
+        raise ValueError(csv_path + ' has ' + str(m) + ' lines but ' + str(start) + ' rows were parsed')
+
+    images.flush()
+    labels.flush()
+    del images, labels
+    os.replace(images_path + '.tmp', images_path)
+    os.replace(labels_path + '.tmp', labels_path)
+
+
+def load_dataset_cached(csv_path, cache_dir=None):
+    """
+    Loads a fashion-mnist csv through a binary cache. The first load converts the csv
+    (convert_dataset), the next ones memory-map the .npy files in milliseconds.
+
+    The cache is keyed by the size, mtime and sha1 of the csv: size and mtime are
+    checked on every load, the sha1 only when they changed (a copied or touched csv
+    with the same content keeps its cache). The csv is parsed again only when the
+    cache is missing or stale.
+
+    Arguments:
+    csv_path -- path of the csv, e.g. 'dataset/fashion-mnist_train.csv'
+    cache_dir -- directory of the cache, <csv dir>/cache if None
+
+    Returns:
+    images -- read only memmap of uint8, of shape (m, 784)
+    labels -- read only memmap of uint8, of shape (m,)
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(csv_path), 'cache')
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    images_path = os.path.join(cache_dir, name + '_images.npy')
+    labels_path = os.path.join(cache_dir, name + '_labels.npy')
+    meta_path = os.path.join(cache_dir, name + '.json')
+
+    stat = os.stat(csv_path)
+    meta = None
+    if os.path.exists(meta_path) and os.path.exists(images_path) and os.path.exists(labels_path):
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+
+    if meta is not None and (meta['size'], meta['mtime']) != (stat.st_size, stat.st_mtime_ns):
+        if meta['size'] == stat.st_size and meta['sha1'] == file_hash(csv_path):
+            meta['mtime'] = stat.st_mtime_ns
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+        else:
+            meta = None
+            os.remove(meta_path)
+
+    if meta is None:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        convert_dataset(csv_path, images_path, labels_path)
+        meta = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': file_hash(csv_path)}
+
+        # the metadata is written last: it is what marks the cache as valid
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    return np.load(images_path, mmap_mode='r'), np.load(labels_path, mmap_mode='r')
+
+
+def reservoir_update(reservoir, seen, chunk, random_state):
+    """
+    Feeds one chunk of a stream to a reservoir (Algorithm R, vectorized over the chunk):
+    the first k examples fill the k slots, then the i-th example of the stream replaces
+    a random slot with probability k/(i+1).
+
+    Arguments:
+    reservoir -- tuple of arrays (images, labels) with the k slots on the first axis
+    seen -- number of examples of the stream fed before this chunk
+    chunk -- tuple of arrays (images, labels) with the examples on the first axis
+    random_state -- np.random.RandomState of the draw
+
+    Returns:
+    seen -- number of examples of the stream fed including this chunk
+    """
+    k = reservoir[0].shape[0]
+    n = chunk[0].shape[0]
+    fill = min(max(k - seen, 0), n)
+    for slots, examples in zip(reservoir, chunk):
+        slots[seen : seen + fill] = examples[:fill]
+
+    position = np.arange(fill, n)
+    slot = random_state.randint(0, seen + position + 1)
+    keep = slot < k
+    # a slot drawn twice in the chunk keeps the later example, as the sequential algorithm does
+    slot, first = np.unique(slot[keep][::-1], return_index=True)
+    position = position[keep][::-1][first]
+    for slots, examples in zip(reservoir, chunk):
+        slots[slot] = examples[position]
+
+    return seen + n
+
+
+def stratified_quotas(class_counts, set_size):
+    """
+    Examples per label of a sample of set_size, proportional to class_counts
+    (largest remainder, so the quotas add up to set_size)
+    """
+    class_counts = np.asarray(class_counts)
+    exact = class_counts * set_size / class_counts.sum()
+    quotas = np.floor(exact).astype(np.int64)
+    quotas[np.argsort(quotas - exact)[:set_size - quotas.sum()]] += 1
+
+    return quotas
+
+
+def reservoir_sample(chunks, set_size, n_x=784, class_counts=None, seed=None):
+    """
+    Uniform random sample without replacement of set_size examples of a stream of
+    (images, labels) chunks, read once front to back. Only the sample is held in memory.
+
+    Arguments:
+    chunks -- iterable of (images, labels), uint8 of shape (rows, n_x) and (rows,)
+    set_size -- number of examples of the sample
+    n_x -- number of pixels of an image
+    class_counts -- examples per label of the whole stream. If given the sample is
+                    stratified: every label has its own reservoir of stratified_quotas slots
+    seed -- seed of the draw, None for a different sample every run
+
+    Returns:
+    images -- uint8 of shape (set_size, n_x), grouped by label when stratified
+    labels -- uint8 of shape (set_size,)
+    """
+    random_state = np.random.RandomState(seed)
+    images = np.empty((set_size, n_x), dtype=np.uint8)
+    labels = np.empty(set_size, dtype=np.uint8)
+
+    # every reservoir is a slice of the output
+    if class_counts is None:
+        quotas = {None: set_size}
+    else:
+        quotas = dict(enumerate(stratified_quotas(class_counts, set_size)))
+    reservoirs = {}
+    start = 0
+    for label, quota in quotas.items():
+        reservoirs[label] = (images[start : start + quota], labels[start : start + quota])
+        start += quota
+    seen = dict.fromkeys(quotas, 0)
+
+    for X, Y in chunks:
+        for label in quotas:
+            chunk = (X, Y) if label is None else (X[Y == label], Y[Y == label])
+            seen[label] = reservoir_update(reservoirs[label], seen[label], chunk, random_state)
+
+    for label in quotas:
+        if seen[label] < quotas[label]:
+            raise ValueError('a sample of ' + str(set_size) + ' examples needs more examples than the set has')
+
+    return images, labels
+
+
+def sample_dataset(images, labels, set_size, stratify=False, chunk_rows=4096):
+    """
+    Random sample of set_size examples without replacement, the whole set if set_size is 0.
+    The memmap is streamed chunk_rows rows at a time through reservoir_sample, stratified
+    by label if stratify is True.
+    """
+    if set_size == 0:
+        return images, labels
+    m = labels.shape[0]
+    class_counts = np.bincount(labels, minlength=10) if stratify else None
+    chunks = ((images[k : k + chunk_rows], labels[k : k + chunk_rows]) for k in range(0, m, chunk_rows))
+
+    return reservoir_sample(chunks, set_size, images.shape[1], class_counts)
+
+
+def peak_rss():
+    """
+    Peak resident set size of the process in MB
+    (ru_maxrss is in KB on linux and in bytes on macOS)
+    """
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 2.**20
+
+    return peak / 2.**10
+
+
+def normalize_batch(X, out=None):
+    """
+    uint8 pixels in [0, 255] to float32 in [0, 1], only for the minibatch that is fed,
+    into out if it is given
+    """
+    return np.multiply(X, np.float32(1/255.), out=out, dtype=np.float32)
@@ -98,10 +98,22 @@ def main():
     parser.add_argument('--predict_image_class', help='predict for image class using the pre trainned weights')
     parser.add_argument('--parameters', help='path of the parameters to use', default='params_model_0.h5')
     parser.add_argument('--num_epochs', help='iteration number', default=1500)
+    parser.add_argument('--batch_size', help='size of mini batches', default=32)
+    parser.add_argument('--workers', help='number of worker processes making the minibatches', default=4)
+    parser.add_argument('--augment', help='augment the trainning images with --shift, --flip and --cutout', action='store_true')
+    parser.add_argument('--shift', help='with --augment, random shift of up to shift pixels of the trainning images, 0 to disable', default=2)
+    parser.add_argument('--flip', help='with --augment, 1 to flip half of the trainning images horizontally, 0 to disable', default=1)
+    parser.add_argument('--cutout', help='with --augment, zero a random cutout x cutout square of the trainning images, 0 to disable', default=0)
     parser.add_argument('--predict_all_with_params', help='probability of keeping the neuron in the dropout method')
     args = parser.parse_args()
 
     num_epochs = int(args.num_epochs)
+    batch_size = int(args.batch_size)
+    workers = int(args.workers)
+    # The trainning images are not augmented unless --augment is given
+    shift = int(args.shift) if args.augment else 0
+    flip = bool(int(args.flip)) if args.augment else False
+    cutout = int(args.cutout) if args.augment else 0
     image_path = args.predict_image_class
     parameters = args.parameters
     if image_path:
@@ -114,9 +126,12 @@ def main():
 
     X_train, Y_train, X_test, Y_test = init_dataset_normalize()
     model = ResNet50((28,28,1))
-    model.compile(optimizer='adam',loss='categorical_crossentropy', metrics=['accuracy'])
-    model.fit(x=X_train,y=Y_train, epochs=num_epochs)
-    model.evaluate(x=X_test, y=Y_test)
+    model.compile(optimizer='adam',loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    # X stays uint8, the worker processes normalize and augment one minibatch at a time
+    train_sequence = AugmentedSequence(X_train, Y_train, batch_size, shift=shift, flip=flip, cutout=cutout)
+    test_sequence = AugmentedSequence(X_test, Y_test, batch_size, shuffle=False)
+    model.fit_generator(train_sequence, epochs=num_epochs, workers=workers, use_multiprocessing=workers > 1)
+    model.evaluate_generator(test_sequence, workers=workers, use_multiprocessing=workers > 1)
     model.save('params_model_resNet_'+str(getNext())+'.h5')
     model.summary()
 
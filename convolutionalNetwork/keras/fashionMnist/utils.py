@@ -1,4 +1,7 @@
+import os
+import sys
 import math
+import multiprocessing
 import warnings
 warnings.filterwarnings("ignore", message="numpy.dtype size changed")
 import numpy as np
@@ -9,47 +12,44 @@ import scipy
 from PIL import Image
 from scipy import ndimage
 import tensorflow as tf
+from keras.utils import Sequence
 from tensorflow.python.framework import ops
 import pandas as pd
+# The dataset cache is shared with the NumPy model, it lives in convolutionalNetwork/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from fashion_dataset import load_dataset_cached, sample_dataset, peak_rss, normalize_batch
 
 
-def init_dataset_normalize(train_set_size=0, test_set_size=0):
+def init_dataset_normalize(train_set_size=0, test_set_size=0, stratify=False):
     """
-        this dataset is the shape 5999,786
-        in order to use int on a cvnn It needs first to reshape to 59999,28,28,1
+        this dataset is the shape 60000,785 (label + 28*28 pixels), it is read from the
+        uint8 cache of load_dataset_cached so the csv is only parsed the first time
+        X is returned as uint8, a view of the memmap of the cache when the whole set is
+        used or a single contiguous gather of the sampled rows otherwise,
+        the batching path normalizes it to float32 one minibatch at a time
+        in order to use int on a cvnn It needs first to reshape to m,28,28,1
         c_n is 1 because is grayscale
+        train_set_size and test_set_size (0 for the whole set) draw a random sample of
+        the set with sample_dataset, stratified by label if stratify is True
     """
-    if train_set_size!=0:
-        train_df = pd.read_csv('dataset/fashion-mnist_train.csv').sample(n=train_set_size)
-    else:
-        train_df = pd.read_csv('dataset/fashion-mnist_train.csv')
-    if test_set_size!=0:
-        test_df = pd.read_csv('dataset/fashion-mnist_test.csv').sample(n=test_set_size)
-    else:
-        test_df = pd.read_csv('dataset/fashion-mnist_test.csv')
+    peak_before = peak_rss()
+    X_train_orig, Y_train_orig = sample_dataset(*load_dataset_cached('dataset/fashion-mnist_train.csv'), train_set_size, stratify)
+    X_test_orig, Y_test_orig = sample_dataset(*load_dataset_cached('dataset/fashion-mnist_test.csv'), test_set_size, stratify)
 
-    Y_train_orig = train_df['label'].values[1:]
-    Y_test_orig = test_df['label'].values[1:]
+    # The labels stay sparse uint8 class indices, of shape (m,)
+    Y_train = Y_train_orig
+    Y_test = Y_test_orig
 
-    Y_train = one_hot_matrix(Y_train_orig, 10).T
-    Y_test = one_hot_matrix(Y_test_orig, 10).T
+    # The images stay uint8, normalize_batch converts each minibatch when it is fed
+    X_train = X_train_orig.reshape(X_train_orig.shape[0], 28, 28, 1)
+    X_test = X_test_orig.reshape(X_test_orig.shape[0], 28, 28, 1)
 
-    X_train_orig = train_df.T[1:].T.values[1:]
-    X_test_orig = test_df.T[1:].T.values[1:]
-
-    X_train_flatten = X_train_orig
-    X_test_flatten = X_test_orig
-
-    # Normalize image vectors
-    X_train = X_train_flatten/255.
-    X_test = X_test_flatten/255.
-
-    X_train = X_train.reshape(X_train.shape[0], 28, 28, 1)
-    X_test = X_test.reshape(X_test.shape[0], 28, 28, 1)
+    print('Dataset loaded: train', X_train.shape, 'test', X_test.shape, 'uint8,',
+          '%.1f MB, peak RSS %.1f MB (%.1f MB before loading)' % ((X_train.nbytes + X_test.nbytes) / 2.**20, peak_rss(), peak_before))
 
     return X_train, Y_train, X_test, Y_test
 
-def create_placeholders(n_H0, n_W0, n_C0, n_y):
+def create_placeholders(n_H0, n_W0, n_C0):
     """
     Creates the placeholders for the tensorflow session.
 
@@ -57,14 +57,13 @@ def create_placeholders(n_H0, n_W0, n_C0, n_y):
     n_H0 -- scalar, height of an input image
     n_W0 -- scalar, width of an input image
     n_C0 -- scalar, number of channels of the input
-    n_y -- scalar, number of classes
 
     Returns:
     X -- placeholder for the data input, of shape [None, n_H0, n_W0, n_C0] and dtype "float"
-    Y -- placeholder for the input labels, of shape [None, n_y] and dtype "float"
+    Y -- placeholder for the input labels, class indices of shape [None] and dtype "int32"
     """
     X = tf.placeholder(dtype=tf.float32, shape=(None, n_H0, n_W0, n_C0), name='X')
-    Y = tf.placeholder(dtype=tf.float32, shape=(None, n_y), name='Y')
+    Y = tf.placeholder(dtype=tf.int32, shape=(None,), name='Y')
 
     return X, Y
 
@@ -146,14 +145,15 @@ def compute_cost(Z3, Y):
     Computes the cost
 
     Arguments:
-    Z3 -- output of forward propagation (output of the last LINEAR unit), of shape (6, number of examples)
-    Y -- "true" labels vector placeholder, same shape as Z3
+    Z3 -- output of forward propagation (output of the last LINEAR unit), of shape (number of examples, 10)
+    Y -- "true" labels vector placeholder, class indices of shape (number of examples,)
 
     Returns:
     cost - Tensor of the cost function
     """
 
-    cost = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(logits=Z3, labels=Y))
+    # sparse labels: no one hot matrix is ever built
+    cost = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(logits=Z3, labels=Y))
 
     return cost
 
@@ -161,61 +161,150 @@ def visualizeImage(X_train_orig, index):
     plt.imshow(X_train_orig.T[index].reshape(28,28), cmap='gray')
     plt.show()
 
-def random_mini_batches(X, Y, mini_batch_size = 64, seed = 0):
+def random_mini_batches(X, Y, mini_batch_size = 64, seed = 0, reuse_buffers = True):
     """
-    Creates a list of random minibatches from (X, Y)
+    Generates random minibatches from (X, Y). Only a permutation of the indices is kept:
+    each minibatch is gathered from X with np.take into a preallocated uint8 buffer and
+    normalized into a preallocated float32 buffer when it is reached, so an epoch costs
+    one minibatch of memory instead of a shuffled copy of the dataset.
 
     Arguments:
-    X -- input data, of shape (input size, number of examples) (m, Hi, Wi, Ci)
-    Y -- true "label" vector (containing 0 if cat, 1 if non-cat), of shape (1, number of examples) (m, n_y)
+    X -- input data, uint8 of shape (m, Hi, Wi, Ci)
+    Y -- true "label" vector, uint8 class indices of shape (m,)
     mini_batch_size - size of the mini-batches, integer
     seed -- this is only for the purpose of grading, so that you're "random minibatches are the same as ours.
+    reuse_buffers -- True to gather every minibatch into the same buffers: a yielded minibatch
+                     is overwritten by the next one, so it has to be consumed (fed to sess.run)
+                     before the next is asked for. False gives every minibatch its own arrays.
 
-    Returns:
-    mini_batches -- list of synchronous (mini_batch_X, mini_batch_Y)
+    Yields:
+    mini_batch -- synchronous (mini_batch_X, mini_batch_Y), mini_batch_X in float32
     """
     m = X.shape[0]                  # number of training examples
-    mini_batches = []
     np.random.seed(seed)
-    # Step 1: Shuffle (X, Y)
-    permutation = list(np.random.permutation(m))
-    shuffled_X = X[permutation,:,:,:]
-    shuffled_Y = Y[permutation,:]
-    # Step 2: Partition (shuffled_X, shuffled_Y). Minus the end case.
-    num_complete_minibatches = math.floor(m/mini_batch_size) # number of mini batches of size mini_batch_size in your partitionning
-    for k in range(0, num_complete_minibatches):
-        mini_batch_X = shuffled_X[k * mini_batch_size : k * mini_batch_size + mini_batch_size,:,:,:]
-        mini_batch_Y = shuffled_Y[k * mini_batch_size : k * mini_batch_size + mini_batch_size,:]
-        mini_batch = (mini_batch_X, mini_batch_Y)
-        mini_batches.append(mini_batch)
-    # Handling the end case (last mini-batch < mini_batch_size)
-    if m % mini_batch_size != 0:
-        mini_batch_X = shuffled_X[num_complete_minibatches * mini_batch_size : m,:,:,:]
-        mini_batch_Y = shuffled_Y[num_complete_minibatches * mini_batch_size : m,:]
-        mini_batch = (mini_batch_X, mini_batch_Y)
-        mini_batches.append(mini_batch)
-
-    return mini_batches
-
-def one_hot_matrix(labels, C):
+    # Step 1: Shuffle the indices of (X, Y)
+    permutation = np.random.permutation(m)
+    # Step 2: Partition, the last mini-batch is smaller when m % mini_batch_size != 0
+    size = min(mini_batch_size, m)
+    X_gather = np.empty((size,) + X.shape[1:], dtype=X.dtype)
+    for k in range(0, m, mini_batch_size):
+        if k == 0 or not reuse_buffers:
+            X_batch = np.empty((size,) + X.shape[1:], dtype=np.float32)
+            Y_batch = np.empty((size,) + Y.shape[1:], dtype=Y.dtype)
+        # sorted so a memmap is read front to back, clip skips the bound checks of
+        # np.take (the indices come from the permutation) and its temporary copy
+        index = np.sort(permutation[k : k + mini_batch_size])
+        n = index.shape[0]
+        np.take(X, index, axis=0, out=X_gather[:n], mode='clip')
+        np.take(Y, index, axis=0, out=Y_batch[:n], mode='clip')
+        normalize_batch(X_gather[:n], out=X_batch[:n])
+        yield (X_batch[:n], Y_batch[:n])
+
+def share_array(array):
+    """
+    Copy of array in shared memory (a multiprocessing RawArray), so the worker processes
+    of fit_generator read the same pages instead of each one holding its own copy.
+    A memmap is already shared through the page cache and is returned as is.
+    """
+    if isinstance(array, np.memmap):
+        return array
+    shared = np.frombuffer(multiprocessing.RawArray('b', max(array.nbytes, 1)), dtype=array.dtype, count=array.size)
+    shared = shared.reshape(array.shape)
+    shared[...] = array
+
+    return shared
+
+def augment_batch(X, random_state, shift=0, flip=False, cutout=0):
     """
-    Creates a matrix where the i-th row corresponds to the ith class number and the jth column
-                     corresponds to the jth training example. So if example j had a label i. Then entry (i,j)
-                     will be 1.
+    Vectorized augmentation of a whole minibatch: every image gets its own random draw
+    but every transformation is a single numpy operation over the batch.
+
     Arguments:
-    labels -- vector containing the labels
-    C -- number of classes, the depth of the one hot dimension
+    X -- normalized minibatch, float32 of shape (m, n_H, n_W, n_C), augmented in place
+    random_state -- np.random.RandomState of the draws
+    shift -- random shift of up to shift pixels in every direction, the image is zero
+             padded by shift and a n_H x n_W window is taken at a random offset
+    flip -- True to flip half of the images horizontally
+    cutout -- if not 0, zero a random cutout x cutout square of every image (Cutout),
+              the square may be partly outside of the image
 
     Returns:
-    one_hot -- one hot matrix
+    X -- the augmented minibatch
+    """
+    (m, n_H, n_W, n_C) = X.shape
+    if shift:
+        X_pad = np.pad(X, ((0, 0), (shift, shift), (shift, shift), (0, 0)), mode='constant')
+        rows = random_state.randint(0, 2 * shift + 1, m)[:, None] + np.arange(n_H)
+        cols = random_state.randint(0, 2 * shift + 1, m)[:, None] + np.arange(n_W)
+        X[...] = X_pad[np.arange(m)[:, None, None], rows[:, :, None], cols[:, None, :]]
+    if flip:
+        flipped = random_state.rand(m) < 0.5
+        X[flipped] = X[flipped, :, ::-1]
+    if cutout:
+        # the center of the square is drawn anywhere in the image
+        top = random_state.randint(0, n_H, m)[:, None] - cutout // 2
+        left = random_state.randint(0, n_W, m)[:, None] - cutout // 2
+        cut_rows = (np.arange(n_H) >= top) & (np.arange(n_H) < top + cutout)
+        cut_cols = (np.arange(n_W) >= left) & (np.arange(n_W) < left + cutout)
+        X[cut_rows[:, :, None] & cut_cols[:, None, :]] = 0
+
+    return X
+
+class AugmentedSequence(Sequence):
+    """
+    keras Sequence of normalized and augmented minibatches of a uint8 set, for
+    fit_generator with workers and use_multiprocessing.
+
+    The set is moved to shared memory (share_array) once, so the worker processes only
+    gather, normalize and augment (augment_batch) their own minibatches. The draws of a
+    minibatch are seeded by (seed, epoch, index), so the workers don't repeat each other's
+    augmentations and a run can be reproduced.
+
+    Arguments:
+    X -- input data, uint8 of shape (m, n_H, n_W, n_C)
+    Y -- true "label" vector, uint8 class indices of shape (m,)
+    batch_size -- size of the mini-batches, integer
+    shuffle -- True for a new permutation of the set every epoch
+    shift, flip, cutout -- augmentations of augment_batch, all disabled by default
+    seed -- seed of the permutations and the augmentations
     """
-    C = tf.constant(C, name='C')
-    one_hot_matrix = tf.one_hot(labels, C, axis=0)
-    sess = tf.Session()
-    one_hot = sess.run(one_hot_matrix)
-    sess.close()
 
-    return one_hot
+    def __init__(self, X, Y, batch_size=32, shuffle=True, shift=0, flip=False, cutout=0, seed=0):
+        self.X = share_array(X)
+        self.Y = share_array(Y)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.shift = shift
+        self.flip = flip
+        self.cutout = cutout
+        self.seed = seed
+        self.epoch = 0
+        self.index = self.permutation()
+
+    def permutation(self):
+        m = self.X.shape[0]
+        if not self.shuffle:
+            return np.arange(m)
+
+        return np.random.RandomState([self.seed, self.epoch]).permutation(m)
+
+    def __len__(self):
+        return int(math.ceil(self.X.shape[0] / float(self.batch_size)))
+
+    def __getitem__(self, index):
+        # sorted so a memmap is read front to back
+        batch = np.sort(self.index[index * self.batch_size : (index + 1) * self.batch_size])
+        X_batch = normalize_batch(np.take(self.X, batch, axis=0, mode='clip'))
+        Y_batch = np.take(self.Y, batch, mode='clip')
+        if self.shift or self.flip or self.cutout:
+            random_state = np.random.RandomState([self.seed, self.epoch, index])
+            augment_batch(X_batch, random_state, self.shift, self.flip, self.cutout)
+
+        return X_batch, Y_batch
+
+    def on_epoch_end(self):
+        self.epoch += 1
+        self.index = self.permutation()
 
 def predict_class(image_path, parameters_path):
     """
@@ -0,0 +1,549 @@
+"""
+Layers, optimizer and training loop of a small Sequential network built on the NumPy kernels of utils.py.
+
+Every layer keeps the cache of its forward pass and hands it to its own backward pass, nothing is copied
+between the two. Outputs are borrowed from a per-layer Workspace, so an output is only valid until the
+next forward pass of the same layer.
+"""
+import math
+import time
+import numpy as np
+from utils import Workspace, conv_forward, conv_backward, pool_forward, pool_backward, workspace_pad
+
+
+def same_padding(n_prev, f, stride):
+    """
+    Padding of TensorFlow's padding='SAME': the output has ceil(n_prev / stride) positions and the extra
+    row/column, when the total padding is odd, goes at the bottom/right.
+
+    Arguments:
+    n_prev -- integer, height (or width) of the input
+    f -- integer, size of the window
+    stride -- integer, stride of the window
+
+    Returns:
+    (pad_before, pad_after) -- integers
+    """
+
+    n = int(math.ceil(n_prev / float(stride)))
+    pad_total = max((n - 1)*stride + f - n_prev, 0)
+
+    return pad_total//2, pad_total - pad_total//2
+
+
+def glorot_uniform(shape, fan_in, fan_out, rng, dtype):
+    """
+    Xavier/Glorot uniform initialization, the one of tf.contrib.layers.xavier_initializer().
+    """
+
+    limit = np.sqrt(6.0/(fan_in + fan_out))
+
+    return rng.uniform(-limit, limit, size=shape).astype(dtype)
+
+
+class Layer(object):
+    """
+    Base class of the layers. A layer has the dictionaries params and grads (empty when it has no parameters),
+    initialize() to create its parameters for an input shape, forward() and backward().
+
+    A layer whose inplace is True may overwrite the array given to forward(), Sequential sets it only when that
+    array is an output buffer of a previous layer. owns_output is False for the layers that can return (a view of)
+    their input instead of a buffer of their own.
+    """
+
+    owns_output = True
+
+    def __init__(self):
+        self.params = {}
+        self.grads = {}
+        self.workspace = Workspace()
+        self.inplace = False
+
+    def initialize(self, input_shape, rng, dtype):
+        """
+        Arguments:
+        input_shape -- shape of one example (without the batch dimension)
+        rng -- numpy RandomState used for the initialization
+        dtype -- dtype of the parameters
+
+        Returns:
+        output_shape -- shape of one output example
+        """
+
+        return input_shape
+
+    def forward(self, A_prev, training):
+        raise NotImplementedError
+
+    def backward(self, dA):
+        raise NotImplementedError
+
+
+class Conv2D(Layer):
+    """
+    Convolution layer, conv_forward()/conv_backward() with the layer's own weights.
+    """
+
+    def __init__(self, n_C, f, stride=1, padding='valid', algorithm="im2col", n_jobs=1, dilation=1, groups=1,
+                 memory_budget=None, backward_algorithm=None):
+        """
+        Arguments:
+        n_C -- integer, number of filters
+        f -- integer, size of the filters
+        stride -- integer, stride of the convolution
+        padding -- 'valid', 'same' (TensorFlow semantics, may pad one more row at the bottom) or an integer
+        algorithm -- convolution algorithm given to conv_forward()
+        n_jobs -- number of threads given to conv_forward()/conv_backward()
+        dilation -- integer, dilation of the filters
+        groups -- integer, number of groups of channels (the number of input channels for a depthwise convolution)
+        memory_budget -- optional number of bytes, the layer is then computed in tiles that fit in it
+        backward_algorithm -- convolution algorithm given to conv_backward(), by default the backward algorithm of
+                              the same family as algorithm: "1x1", "auto" and "loop" are kept, the others use "col2im"
+        """
+
+        Layer.__init__(self)
+        self.n_C = n_C
+        self.f = f
+        self.stride = stride
+        self.padding = padding
+        self.algorithm = algorithm
+        if backward_algorithm is None:
+            backward_algorithm = algorithm if algorithm in ("1x1", "auto", "loop") else "col2im"
+        self.backward_algorithm = backward_algorithm
+        self.n_jobs = n_jobs
+        self.dilation = dilation
+        self.groups = groups
+        self.memory_budget = memory_budget
+
+    def initialize(self, input_shape, rng, dtype):
+        (n_H_prev, n_W_prev, n_C_prev) = input_shape
+        f = self.f
+        # Size of the input window a dilated filter covers
+        f_dilated = (f - 1)*self.dilation + 1
+
+        if self.padding == 'valid':
+            self.pads = (0, 0, 0, 0)
+        elif self.padding == 'same':
+            self.pads = same_padding(n_H_prev, f_dilated, self.stride) + same_padding(n_W_prev, f_dilated, self.stride)
+        else:
+            self.pads = (self.padding,)*4
+
+        # conv_forward() pads the same amount on every side, uneven 'same' padding is done by the layer
+        self.hparameters = {"stride": self.stride, "pad": 0, "dilation": self.dilation, "groups": self.groups}
+        if len(set(self.pads)) == 1:
+            self.hparameters["pad"] = self.pads[0]
+
+        n_C_group = n_C_prev//self.groups
+        self.params["W"] = glorot_uniform((f, f, n_C_group, self.n_C), f*f*n_C_group, f*f*self.n_C//self.groups, rng, dtype)
+        self.params["b"] = np.zeros((1, 1, 1, self.n_C), dtype=dtype)
+
+        (top, bottom, left, right) = self.pads
+        n_H = int((n_H_prev + top + bottom - f_dilated)/self.stride) + 1
+        n_W = int((n_W_prev + left + right - f_dilated)/self.stride) + 1
+
+        return (n_H, n_W, self.n_C)
+
+    def forward(self, A_prev, training):
+        if self.hparameters["pad"] == 0 and self.pads != (0, 0, 0, 0):
+            (top, bottom, left, right) = self.pads
+            A_prev = np.pad(A_prev, ((0, 0), (top, bottom), (left, right), (0, 0)), "constant")
+
+        Z, self.cache = conv_forward(A_prev, self.params["W"], self.params["b"], self.hparameters,
+                                     algorithm=self.algorithm, workspace=self.workspace, n_jobs=self.n_jobs,
+                                     memory_budget=self.memory_budget)
+
+        return Z
+
+    def backward(self, dZ):
+        dA_prev, self.grads["W"], self.grads["b"] = conv_backward(dZ, self.cache, algorithm=self.backward_algorithm,
+                                                                  workspace=self.workspace, n_jobs=self.n_jobs,
+                                                                  memory_budget=self.memory_budget)
+
+        if self.hparameters["pad"] == 0 and self.pads != (0, 0, 0, 0):
+            (top, bottom, left, right) = self.pads
+            dA_prev = dA_prev[:, top:dA_prev.shape[1] - bottom, left:dA_prev.shape[2] - right, :]
+
+        return dA_prev
+
+
+class Pool2D(Layer):
+    """
+    Pooling layer, pool_forward()/pool_backward(). Max pooling caches the argmax of every window.
+    """
+
+    def __init__(self, f, stride, mode="max", padding='valid', n_jobs=1):
+        """
+        Arguments:
+        f -- integer, size of the window
+        stride -- integer, stride of the window
+        mode -- "max" or "average"
+        padding -- 'valid' or 'same'. 'same' pads with zeros, which gives the same result as TensorFlow's
+                   max pooling only if the input is non negative (after a ReLU), so it is only allowed with "max"
+        n_jobs -- number of threads given to pool_forward()/pool_backward()
+        """
+
+        Layer.__init__(self)
+        if padding == 'same' and mode != "max":
+            raise ValueError("padding='same' is only supported for max pooling")
+        self.hparameters = {"f": f, "stride": stride}
+        self.mode = mode
+        self.padding = padding
+        self.n_jobs = n_jobs
+
+    def initialize(self, input_shape, rng, dtype):
+        (n_H_prev, n_W_prev, n_C_prev) = input_shape
+        f = self.hparameters["f"]
+        stride = self.hparameters["stride"]
+
+        self.pads = (0, 0, 0, 0)
+        if self.padding == 'same':
+            self.pads = same_padding(n_H_prev, f, stride) + same_padding(n_W_prev, f, stride)
+        (top, bottom, left, right) = self.pads
+
+        n_H = int((n_H_prev + top + bottom - f)/stride) + 1
+        n_W = int((n_W_prev + left + right - f)/stride) + 1
+
+        return (n_H, n_W, n_C_prev)
+
+    def forward(self, A_prev, training):
+        (top, bottom, left, right) = self.pads
+        if self.pads != (0, 0, 0, 0):
+            if len(set(self.pads)) == 1:
+                A_prev = workspace_pad(self.workspace, A_prev, top, "A_prev_pad")
+            else:
+                A_prev = np.pad(A_prev, ((0, 0), (top, bottom), (left, right), (0, 0)), "constant")
+
+        A, self.cache = pool_forward(A_prev, self.hparameters, self.mode, cache_argmax=(self.mode == "max"),
+                                     workspace=self.workspace, n_jobs=self.n_jobs)
+
+        return A
+
+    def backward(self, dA):
+        dA_prev = pool_backward(dA, self.cache, self.mode, workspace=self.workspace, n_jobs=self.n_jobs)
+
+        (top, bottom, left, right) = self.pads
+        if self.pads != (0, 0, 0, 0):
+            dA_prev = dA_prev[:, top:dA_prev.shape[1] - bottom, left:dA_prev.shape[2] - right, :]
+
+        return dA_prev
+
+
+class ReLU(Layer):
+    """
+    ReLU activation, applied in place on the output of the previous layer when inplace is set, written to a
+    buffer of the layer otherwise.
+    """
+
+    def forward(self, Z, training):
+        # The previous layer does not need Z for its backward pass (its cache holds its own input)
+        out = Z if self.inplace else self.workspace.empty("A", Z.shape, Z.dtype)
+        self.A = np.maximum(Z, 0, out=out)
+
+        return self.A
+
+    def backward(self, dA):
+        dZ = self.workspace.empty("dZ", dA.shape, dA.dtype)
+        np.multiply(dA, self.A > 0, out=dZ)
+
+        return dZ
+
+
+class Dropout(Layer):
+    """
+    Inverted dropout, keeps every neuron with probability keep_prob during training. Like ReLU, it only
+    overwrites its input when inplace is set. At inference it returns its input.
+    """
+
+    owns_output = False
+
+    def __init__(self, keep_prob, seed=0):
+        Layer.__init__(self)
+        self.keep_prob = keep_prob
+        self.rng = np.random.RandomState(seed)
+
+    def forward(self, A, training):
+        if not training or self.keep_prob >= 1:
+            self.mask = None
+            return A
+
+        self.mask = (self.rng.uniform(size=A.shape) < self.keep_prob).astype(A.dtype)/self.keep_prob
+        out = A if self.inplace else self.workspace.empty("A", A.shape, A.dtype)
+        np.multiply(A, self.mask, out=out)
+
+        return out
+
+    def backward(self, dA):
+        if self.mask is None:
+            return dA
+
+        return dA*self.mask
+
+
+class Flatten(Layer):
+    """
+    Reshapes (m, n_H, n_W, n_C) to (m, n_H*n_W*n_C), a view of the input.
+    """
+
+    owns_output = False
+
+    def initialize(self, input_shape, rng, dtype):
+        self.input_shape = input_shape
+
+        return (int(np.prod(input_shape)),)
+
+    def forward(self, A_prev, training):
+        return A_prev.reshape(A_prev.shape[0], -1)
+
+    def backward(self, dA):
+        return dA.reshape((dA.shape[0],) + self.input_shape)
+
+
+class Dense(Layer):
+    """
+    Fully connected layer without activation, Z = A_prev W + b.
+    """
+
+    def __init__(self, n_units):
+        Layer.__init__(self)
+        self.n_units = n_units
+
+    def initialize(self, input_shape, rng, dtype):
+        (n_prev,) = input_shape
+        self.params["W"] = glorot_uniform((n_prev, self.n_units), n_prev, self.n_units, rng, dtype)
+        self.params["b"] = np.zeros((1, self.n_units), dtype=dtype)
+
+        return (self.n_units,)
+
+    def forward(self, A_prev, training):
+        self.A_prev = A_prev
+        Z = self.workspace.empty("Z", (A_prev.shape[0], self.n_units), self.params["W"].dtype)
+        np.dot(A_prev, self.params["W"], out=Z)
+        Z += self.params["b"]
+
+        return Z
+
+    def backward(self, dZ):
+        self.grads["W"] = np.dot(self.A_prev.T, dZ)
+        self.grads["b"] = dZ.sum(axis=0, keepdims=True)
+
+        return np.dot(dZ, self.params["W"].T)
+
+
+class SoftmaxCrossEntropy(object):
+    """
+    Softmax activation and cross-entropy cost of the last layer, computed together for numerical stability.
+    """
+
+    def forward(self, Z, Y):
+        """
+        Arguments:
+        Z -- output of the last linear layer, of shape (m, n_y)
+        Y -- class indices (e.g. uint8), of shape (m,)
+
+        Returns:
+        cost -- mean cross-entropy of the batch
+        """
+
+        Z_shift = Z - Z.max(axis=1, keepdims=True)
+        log_probs = Z_shift - np.log(np.exp(Z_shift).sum(axis=1, keepdims=True))
+        self.probs = np.exp(log_probs)
+        self.Y = Y
+
+        # Only the log probability of the true class of every example, the labels are never densified
+        return float(-np.sum(log_probs[np.arange(Z.shape[0]), Y])/Z.shape[0])
+
+    def backward(self):
+        """
+        Returns:
+        dZ -- gradient of the mean cost with respect to Z
+        """
+
+        # probs - one_hot(Y), computed in place on the probabilities of the last forward()
+        m = self.Y.shape[0]
+        dZ = self.probs
+        dZ[np.arange(m), self.Y] -= 1
+        dZ /= m
+
+        return dZ
+
+
+class Adam(object):
+    """
+    Adam optimizer, updates the parameters of the layers in place.
+    """
+
+    def __init__(self, learning_rate=0.001, beta1=0.9, beta2=0.999, epsilon=1e-8):
+        self.learning_rate = learning_rate
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.t = 0
+        self.v = {}
+        self.s = {}
+
+    def update(self, layers):
+        self.t += 1
+        # Bias correction folded in the step size
+        lr_t = float(self.learning_rate*math.sqrt(1 - self.beta2**self.t)/(1 - self.beta1**self.t))
+
+        for (index, layer) in enumerate(layers):
+            for (name, param) in layer.params.items():
+                grad = layer.grads[name]
+                key = (index, name)
+                if key not in self.v:
+                    self.v[key] = np.zeros_like(param)
+                    self.s[key] = np.zeros_like(param)
+                v = self.v[key]
+                s = self.s[key]
+
+                v *= self.beta1
+                v += (1 - self.beta1)*grad
+                s *= self.beta2
+                s += (1 - self.beta2)*np.square(grad)
+                param -= lr_t*v/(np.sqrt(s) + self.epsilon)
+
+
+class Sequential(object):
+    """
+    Stack of layers trained with a softmax cross-entropy cost.
+    """
+
+    def __init__(self, layers, input_shape, dtype=np.float32, seed=0):
+        """
+        Arguments:
+        layers -- list of Layer instances
+        input_shape -- shape of one input example, (n_H, n_W, n_C)
+        dtype -- dtype of the parameters and of the computations
+        seed -- seed of the parameters initialization
+        """
+
+        self.layers = layers
+        self.loss = SoftmaxCrossEntropy()
+        self.dtype = np.dtype(dtype)
+
+        rng = np.random.RandomState(seed)
+        shape = tuple(input_shape)
+        # The input X belongs to the caller, the layers may only overwrite the buffers of the previous layers
+        owned = False
+        for layer in self.layers:
+            shape = layer.initialize(shape, rng, self.dtype)
+            layer.inplace = owned
+            owned = owned or layer.owns_output
+        self.output_shape = shape
+
+    def forward(self, X, training=False):
+        A = X.astype(self.dtype, copy=False)
+        for layer in self.layers:
+            A = layer.forward(A, training)
+
+        return A
+
+    def backward(self, dZ):
+        for layer in reversed(self.layers):
+            dZ = layer.backward(dZ)
+
+        return dZ
+
+    def train_step(self, X, Y, optimizer):
+        """
+        Forward, backward and parameters update on one minibatch.
+
+        Returns:
+        cost -- cost of the minibatch before the update
+        """
+
+        Z = self.forward(X, training=True)
+        cost = self.loss.forward(Z, Y)
+        self.backward(self.loss.backward())
+        optimizer.update(self.layers)
+
+        return cost
+
+    def fit(self, X, Y, optimizer, num_epochs=100, minibatch_size=32, seed=3, print_cost=True, preprocess=None):
+        """
+        Minibatch training loop.
+
+        Arguments:
+        X -- training set, of shape (m, n_H, n_W, n_C)
+        Y -- class indices (e.g. uint8), of shape (m,)
+        optimizer -- Adam instance
+        num_epochs -- number of epochs of the optimization loop
+        minibatch_size -- size of a minibatch
+        seed -- seed of the shuffling, incremented every epoch
+        print_cost -- True to print the cost every 10 epochs
+        preprocess -- optional function applied to every minibatch of X before the forward pass, e.g. the
+                      normalization of uint8 images, so the whole set never has to be converted
+
+        Returns:
+        costs -- list of the cost of every epoch
+        """
+
+        m = X.shape[0]
+        costs = []
+
+        for epoch in range(num_epochs):
+            start = time.time()
+            seed = seed + 1
+            permutation = np.random.RandomState(seed).permutation(m)
+
+            epoch_cost = 0.
+            for k in range(0, m, minibatch_size):
+                indices = permutation[k:k + minibatch_size]
+                X_batch = X[indices]
+                if preprocess is not None:
+                    X_batch = preprocess(X_batch)
+                cost = self.train_step(X_batch, Y[indices], optimizer)
+                epoch_cost += cost*len(indices)/m
+
+            costs.append(epoch_cost)
+            if print_cost and epoch % 10 == 0:
+                print("Cost after epoch %i: %f (%.1f examples/sec)" % (epoch, epoch_cost, m/(time.time() - start)))
+
+        return costs
+
+    def predict(self, X, batch_size=1000, preprocess=None):
+        """
+        Arguments:
+        X -- examples, of shape (m, n_H, n_W, n_C)
+        batch_size -- number of examples of a forward pass
+        preprocess -- optional function applied to every batch of X, like in fit()
+
+        Returns:
+        predictions -- numpy array of shape (m,) with the predicted class of every example
+        """
+
+        predictions = np.empty(X.shape[0], dtype=np.int64)
+        for k in range(0, X.shape[0], batch_size):
+            X_batch = X[k:k + batch_size]
+            if preprocess is not None:
+                X_batch = preprocess(X_batch)
+            predictions[k:k + batch_size] = self.forward(X_batch).argmax(axis=1)
+
+        return predictions
+
+    def accuracy(self, X, Y, batch_size=1000, preprocess=None):
+        """
+        Arguments:
+        X -- examples, of shape (m, n_H, n_W, n_C)
+        Y -- class indices (e.g. uint8), of shape (m,)
+        batch_size -- number of examples of a forward pass
+        preprocess -- optional function applied to every batch of X, like in fit()
+
+        Returns:
+        accuracy -- fraction of the examples that are correctly classified
+        """
+
+        return float(np.mean(self.predict(X, batch_size, preprocess) == Y))
+
+    def get_parameters(self):
+        parameters = {}
+        for (index, layer) in enumerate(self.layers):
+            for (name, param) in layer.params.items():
+                parameters["%s%d" % (name, index)] = param
+
+        return parameters
+
+    def set_parameters(self, parameters):
+        for (index, layer) in enumerate(self.layers):
+            for name in layer.params:
+                layer.params[name][...] = parameters["%s%d" % (name, index)]
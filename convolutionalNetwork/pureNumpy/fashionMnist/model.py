@@ -0,0 +1,120 @@
+import os
+import sys
+# The NumPy kernels (utils.py) and the layers (layers.py) live in convolutionalNetwork/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import argparse
+import numpy as np
+from layers import *
+from utils import Profiler, default_autotuner
+from fashion_dataset import load_dataset_cached, sample_dataset, normalize_batch
+
+
+def init_dataset_normalize(train_set_size=0, test_set_size=0, stratify=False):
+    """
+        this dataset is the shape 60000,785 (label + 28*28 pixels), it is read from the
+        uint8 cache of load_dataset_cached so the csv is only parsed the first time
+        the images are reshaped to (m, 28, 28, 1) because c_n is 1 (grayscale) and stay
+        uint8, Sequential.fit normalizes them with normalize_batch one minibatch at a time
+        train_set_size and test_set_size (0 for the whole set) draw a random sample of
+        the set with sample_dataset, stratified by label if stratify is True
+    """
+    X_train, Y_train = sample_dataset(*load_dataset_cached('dataset/fashion-mnist_train.csv'), train_set_size, stratify)
+    X_test, Y_test = sample_dataset(*load_dataset_cached('dataset/fashion-mnist_test.csv'), test_set_size, stratify)
+
+    # The labels stay sparse uint8 class indices, of shape (m,)
+
+    X_train = X_train.reshape(X_train.shape[0], 28, 28, 1)
+    X_test = X_test.reshape(X_test.shape[0], 28, 28, 1)
+
+    return X_train, Y_train, X_test, Y_test
+
+
+def ModelFashionMnist(input_shape=(28, 28, 1), keep_prob=1, algorithm="im2col", n_jobs=1):
+    """
+    Same network as convolutionalNetwork/tensorflow/fashionMnist:
+    CONV2D -> RELU -> MAXPOOL -> CONV2D -> RELU -> MAXPOOL -> FLATTEN -> FULLYCONNECTED
+
+    Arguments:
+    input_shape -- shape of the images of the dataset
+    keep_prob -- probability of keeping the neuron in the dropout method
+    algorithm -- convolution algorithm of the conv layers ("im2col", "auto", ...)
+    n_jobs -- number of threads of the conv and pool layers
+
+    Returns:
+    model -- a Sequential() instance
+    """
+
+    layers = [Conv2D(8, 3, stride=1, padding='same', algorithm=algorithm, n_jobs=n_jobs),   # (28, 28, 8)
+              ReLU(),
+              Dropout(keep_prob),
+              Pool2D(3, 3, mode="max", padding='same', n_jobs=n_jobs),                    # (10, 10, 8)
+              Conv2D(16, 2, stride=1, padding='same', algorithm=algorithm, n_jobs=n_jobs),  # (10, 10, 16)
+              ReLU(),
+              Dropout(keep_prob, seed=1),
+              Pool2D(3, 3, mode="max", padding='same', n_jobs=n_jobs),                    # (4, 4, 16)
+              Flatten(),                                                                    # 256
+              Dense(10)]
+    model = Sequential(layers, input_shape)
+
+    assert model.output_shape == (10,)
+
+    return model
+
+
+"""
+UTILS TO SAVE files
+"""
+def getNext():
+    import json
+
+    with open('sequence.json', 'r') as f:
+        sequence_load = json.load(f)
+
+    next = int(sequence_load['next'])
+
+    sequence_next = {'next':next+1}
+    with open('./sequence.json', 'w') as f:
+        json.dump(sequence_next, f)
+
+    return next
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--learning_rate', help='learning rate for the algorithm', default=0.009)
+    parser.add_argument('--batch_size', help='size of mini batches', default=64)
+    parser.add_argument('--num_epochs', help='iteration number', default=100)
+    parser.add_argument('--train_size', help='The size of the trainning set', default=0)
+    parser.add_argument('--test_size', help='The size of the test set', default=0)
+    parser.add_argument('--stratify', help='sample train_size and test_size with the label proportions of the sets', action='store_true')
+    parser.add_argument('--keep_prob', help='probability of keeping the neuron in the dropout method', default=1)
+    parser.add_argument('--algorithm', help='convolution algorithm: im2col, winograd, fft or auto', default='im2col')
+    parser.add_argument('--n_jobs', help='number of threads of the conv and pool layers, -1 for every core', default=1)
+    parser.add_argument('--autotune_cache', help='json file of the algorithms picked by --algorithm auto, the user cache dir if empty', default='')
+    parser.add_argument('--profile', help='json file of the per-kernel profile of the training, none if empty', default='')
+    args = parser.parse_args()
+    if args.autotune_cache:
+        default_autotuner.path = args.autotune_cache
+
+    X_train, Y_train, X_test, Y_test = init_dataset_normalize(int(args.train_size), int(args.test_size), args.stratify)
+
+    model = ModelFashionMnist(keep_prob=float(args.keep_prob), algorithm=args.algorithm, n_jobs=int(args.n_jobs))
+    optimizer = Adam(learning_rate=float(args.learning_rate))
+    if args.profile:
+        with Profiler(path=args.profile):
+            model.fit(X_train, Y_train, optimizer, num_epochs=int(args.num_epochs), minibatch_size=int(args.batch_size),
+                      preprocess=normalize_batch)
+    else:
+        model.fit(X_train, Y_train, optimizer, num_epochs=int(args.num_epochs), minibatch_size=int(args.batch_size),
+                  preprocess=normalize_batch)
+
+    print("Train Accuracy:", model.accuracy(X_train, Y_train, preprocess=normalize_batch))
+    print("Test Accuracy:", model.accuracy(X_test, Y_test, preprocess=normalize_batch))
+
+    if not os.path.exists('./params'):
+        os.makedirs('./params')
+    np.savez('./params/model_'+str(getNext())+'.npz', **model.get_parameters())
+
+
+if __name__ == '__main__':
+    main()
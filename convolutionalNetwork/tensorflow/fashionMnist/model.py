@@ -11,22 +11,29 @@ import tensorflow as tf
 from tensorflow.python.framework import ops
 import argparse
 import sys
+import time
 
 def model(X_train, Y_train, X_test, Y_test, learning_rate = 0.009,
-          num_epochs = 100, minibatch_size = 32, print_cost = True, keep_prob=1):
+          num_epochs = 100, minibatch_size = 32, print_cost = True, keep_prob=1,
+          batch_method = 'basic', thread_count = 2, prefetch = 4, cost_every = 50):
     """
     Implements a three-layer ConvNet in Tensorflow:
     CONV2D -> RELU -> MAXPOOL -> CONV2D -> RELU -> MAXPOOL -> FLATTEN -> FULLYCONNECTED
 
     Arguments:
-    X_train -- training set, of shape (None, 28, 28, 1)
-    Y_train -- test set, of shape (None, n_y = 10)
-    X_test -- training set, of shape (None, 28, 28, 1)
-    Y_test -- test set, of shape (None, n_y = 10)
+    X_train -- training set, uint8 of shape (None, 28, 28, 1)
+    Y_train -- test set, uint8 class indices of shape (None,)
+    X_test -- training set, uint8 of shape (None, 28, 28, 1)
+    Y_test -- test set, uint8 class indices of shape (None,)
     learning_rate -- learning rate of the optimization
     num_epochs -- number of epochs of the optimization loop
     minibatch_size -- size of a minibatch
     print_cost -- True to print the cost every 10 epochs
+    batch_method -- 'basic' feeds the minibatches of random_mini_batches, 'dataset' reads
+                    them from the tf.data pipeline of dataset_mini_batches inside the graph
+    thread_count -- parallel calls of the normalization of the dataset pipeline
+    prefetch -- minibatches prefetched by the dataset pipeline
+    cost_every -- fetch the cost every cost_every steps, the epoch cost is the mean of the fetched ones
 
     Returns:
     train_accuracy -- real number, accuracy on the train set (X_train)
@@ -38,11 +45,14 @@ def model(X_train, Y_train, X_test, Y_test, learning_rate = 0.009,
     tf.set_random_seed(1)                             # to keep results consistent (tensorflow seed)
     seed = 3                                          # to keep results consistent (numpy seed)
     (m, n_H0, n_W0, n_C0) = X_train.shape
-    n_y = Y_train.shape[1]
     costs = []                                        # To keep track of the cost
 
     # Create Placeholders of the correct shape
-    X, Y = create_placeholders(n_H0, n_W0, n_C0, n_y)
+    if batch_method == 'dataset':
+        X_source, Y_source, iterator = dataset_mini_batches((n_H0, n_W0, n_C0), minibatch_size, num_epochs, thread_count, prefetch, seed)
+        X, Y = create_placeholders(n_H0, n_W0, n_C0, iterator.get_next())
+    else:
+        X, Y = create_placeholders(n_H0, n_W0, n_C0)
     # Initialize parameters
     parameters = initialize_parameters()
     # Forward propagation: Build the forward propagation in the tensorflow graph
@@ -64,27 +74,42 @@ def model(X_train, Y_train, X_test, Y_test, learning_rate = 0.009,
     with tf.Session(config=config) as sess:
         # Run the initialization
         sess.run(init)
+        if batch_method == 'dataset':
+            sess.run(iterator.initializer, feed_dict={X_source: X_train, Y_source: Y_train})
         # Do the training loop
+        training_start = time.time()
         for epoch in range(num_epochs):
-            minibatch_cost = 0.
-            num_minibatches = int(m / minibatch_size) # number of minibatches of size minibatch_size in the train set
+            epoch_start = time.time()
+            minibatch_costs = []
             seed = seed + 1
-            minibatches = random_mini_batches(X_train, Y_train, minibatch_size, seed)
 
-            for minibatch in minibatches:
-                # Select a minibatch
-                (minibatch_X, minibatch_Y) = minibatch
+            if batch_method == 'dataset':
+                # the minibatch comes from the pipeline inside the graph
+                feed_dicts = (None for i in range(0, m, minibatch_size))
+            else:
+                feed_dicts = ({X: minibatch_X, Y: minibatch_Y} for (minibatch_X, minibatch_Y) in random_mini_batches(X_train, Y_train, minibatch_size, seed))
+
+            for step, feed_dict in enumerate(feed_dicts):
                 # IMPORTANT: The line that runs the graph on a minibatch.
-                # Run the session to execute the optimizer and the cost, the feedict should contain a minibatch for (X,Y).
-                _ , temp_cost = sess.run([optimizer, cost], feed_dict={X:X_train, Y:Y_train})
-                minibatch_cost += temp_cost / num_minibatches
+                # The cost is only fetched every cost_every steps (and on the first of every
+                # epoch), the other steps just run the optimizer.
+                if step % cost_every == 0:
+                    _ , temp_cost = sess.run([optimizer, cost], feed_dict=feed_dict)
+                    minibatch_costs.append(temp_cost)
+                else:
+                    sess.run(optimizer, feed_dict=feed_dict)
+            # mean of the fetched minibatch costs
+            minibatch_cost = np.mean(minibatch_costs)
 
             # Print the cost every epoch
             if print_cost == True and epoch % 10 == 0:
-                print ("Cost after epoch %i: %f" % (epoch, minibatch_cost))
+                print ("Cost after epoch %i: %f (%.0f examples/s)" % (epoch, minibatch_cost, m / (time.time() - epoch_start)))
             if print_cost == True and epoch % 1 == 0:
                 costs.append(minibatch_cost)
 
+        training_time = time.time() - training_start
+        print("Trained %i epochs in %.1f s: %.0f examples/s" % (num_epochs, training_time, num_epochs * m / training_time))
+
         #save parameters to latter use when making predictions
         saver.save(sess, './params/model_'+str(getNext()))
         # plot the cost
@@ -95,12 +120,12 @@ def model(X_train, Y_train, X_test, Y_test, learning_rate = 0.009,
         plt.show()
         # Calculate the correct predictions
         predict_op = tf.argmax(Z3, 1)
-        correct_prediction = tf.equal(predict_op, tf.argmax(Y, 1))
+        correct_prediction = tf.equal(predict_op, tf.cast(Y, tf.int64))
         # Calculate accuracy on the test set
         accuracy = tf.reduce_mean(tf.cast(correct_prediction, "float"))
         print(accuracy)
-        train_accuracy = accuracy.eval({X: X_train, Y: Y_train})
-        test_accuracy = accuracy.eval({X: X_test, Y: Y_test})
+        train_accuracy = evaluate_in_batches(accuracy, X, Y, X_train, Y_train)
+        test_accuracy = evaluate_in_batches(accuracy, X, Y, X_test, Y_test)
         print("Train Accuracy:", train_accuracy)
         print("Test Accuracy:", test_accuracy)
 
@@ -115,7 +140,12 @@ def main():
     parser.add_argument('--parameters', help='path of the parameters to use', default='model_0')
     parser.add_argument('--train_size', help='The size of the trainning set', default=0)
     parser.add_argument('--test_size', help='The size of the test set', default=0)
+    parser.add_argument('--stratify', help='sample train_size and test_size with the label proportions of the sets', action='store_true')
     parser.add_argument('--keep_prob', help='probability of keeping the neuron in the dropout method', default=1)
+    parser.add_argument('--cost_every', help='fetch the cost of a minibatch every cost_every steps', default=50)
+    parser.add_argument('--batch_method', help='method used to make the mini batches: basic or dataset', default='basic')
+    parser.add_argument('--thread_count', help='This is only for batch method dataset, parallel calls of the normalization', default=2)
+    parser.add_argument('--prefetch', help='This is only for batch method dataset, number of minibatches prefetched', default=4)
     parser.add_argument('--predict_all_with_params', help='probability of keeping the neuron in the dropout method')
     args = parser.parse_args()
 
@@ -136,7 +166,9 @@ def main():
     learning_rate = float(args.learning_rate)
     keep_prob = float(args.keep_prob)
 
-    X_train, Y_train, X_test, Y_test = init_dataset_normalize(train_set_size, test_set_size)
-    model(X_train, Y_train, X_test, Y_test, num_epochs=num_epochs, learning_rate=learning_rate, keep_prob=keep_prob)
+    X_train, Y_train, X_test, Y_test = init_dataset_normalize(train_set_size, test_set_size, args.stratify)
+    model(X_train, Y_train, X_test, Y_test, num_epochs=num_epochs, learning_rate=learning_rate, keep_prob=keep_prob,
+          minibatch_size=int(args.batch_size), batch_method=args.batch_method, thread_count=int(args.thread_count),
+          prefetch=int(args.prefetch), cost_every=int(args.cost_every))
 
 main()
@@ -1,4 +1,366 @@
-def zero_pad(X, pad):
+"""
+NumPy implementation of the convolution and pooling layers.
+
+Every kernel keeps the floating point dtype of its inputs: float32 arrays give float32 outputs and
+gradients, float64 arrays give float64 (integer inputs, e.g. raw uint8 images, are computed in float32).
+float32 halves the memory traffic and runs the BLAS products about twice as fast.
+
+Accumulation precision: the matrix products (im2col, col2im, winograd) accumulate in the dtype of
+the inputs, i.e. in float32 for float32 layers, like cuDNN without TF32. numpy sums (db, average pooling)
+use pairwise summation, so their rounding error grows with log(n) and not with n. The FFT path multiplies the
+spectra in complex64 for float32 inputs (NumPy < 2 computes the transforms themselves in complex128, they
+are cast down before the product). Expect float32 results to match float64 to about 1e-6 relative error,
+more for very long reductions (dW over a large batch).
+"""
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+class Workspace(object):
+    """
+    Pool of preallocated buffers that the layers borrow instead of allocating new arrays on every call.
+
+    A buffer is identified by its name, shape and dtype and is allocated (with zeros) the first time it is
+    asked for. The next requests get the same memory back, so an array borrowed from a workspace is only
+    valid until the next call that borrows the same buffer. Use one workspace per layer in a training loop.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+        self.shards = {}
+
+    def empty(self, name, shape, dtype=np.float64):
+        """
+        Returns the buffer (name, shape, dtype), its content is whatever the last user left in it.
+        """
+
+        key = (name, tuple(shape), np.dtype(dtype))
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = np.zeros(shape, dtype=dtype)
+            self.buffers[key] = buffer
+
+        return buffer
+
+    def zeros(self, name, shape, dtype=np.float64):
+        """
+        Returns the buffer (name, shape, dtype) filled with zeros.
+        """
+
+        buffer = self.empty(name, shape, dtype)
+        buffer.fill(0)
+
+        return buffer
+
+    def shard(self, index):
+        """
+        Returns the child workspace of the index-th worker of a batch-sharded call, so that two workers never
+        borrow the same buffer.
+        """
+
+        if index not in self.shards:
+            self.shards[index] = Workspace()
+
+        return self.shards[index]
+
+    def nbytes(self):
+        return (sum(buffer.nbytes for buffer in self.buffers.values()) +
+                sum(shard.nbytes() for shard in self.shards.values()))
+
+    def clear(self):
+        self.buffers = {}
+        self.shards = {}
+
+
+def workspace_empty(workspace, name, shape, dtype=np.float64):
+    """
+    np.empty() when workspace is None, the workspace buffer otherwise.
+    """
+
+    if workspace is None:
+        return np.empty(shape, dtype=dtype)
+
+    return workspace.empty(name, shape, dtype)
+
+
+def compute_dtype(*arrays):
+    """
+    Floating point dtype the kernels compute in for the given input arrays.
+
+    Arguments:
+    arrays -- numpy arrays taking part in the computation
+
+    Returns:
+    dtype -- float32 when every input is float32 (or a small integer type such as uint8), float64 otherwise
+    """
+
+    return np.result_type(np.float32, *[array.dtype for array in arrays])
+
+
+def workspace_zeros(workspace, name, shape, dtype=np.float64):
+    """
+    np.zeros() when workspace is None, the workspace buffer filled with zeros otherwise.
+    """
+
+    if workspace is None:
+        return np.zeros(shape, dtype=dtype)
+
+    return workspace.zeros(name, shape, dtype)
+
+
+class Profiler(object):
+    """
+    Opt-in profiler of the kernels of this module (zero_pad, conv_forward, conv_backward, pool_forward,
+    pool_backward). Used as a context manager or a decorator, it records every kernel call made inside it:
+
+        with Profiler(path="profile.json"):
+            model.fit(...)
+
+    For every kernel and input shapes it reports the number of calls, the wall time (inclusive and self, a
+    zero_pad called by conv_forward is counted in both), an estimate of the floating point operations and the
+    bytes of the outputs, plus the peak of the memory allocated by the call when memory=True (tracemalloc
+    slows the allocations down, so it is off by default). The report is printed, and written as json to
+    path, when the profiler exits.
+
+    When no profiler is active a kernel call only costs one extra function call and a test of active_profiler.
+    """
+
+    def __init__(self, path=None, memory=False, print_report=True):
+        """
+        Arguments:
+        path -- optional json file the report is written to when the profiler exits
+        memory -- True to also record the peak memory allocated by every call, with tracemalloc
+        print_report -- True to print the report when the profiler exits
+        """
+
+        self.path = path
+        self.memory = memory
+        self.print_report = print_report
+        self.stats = {}
+        self.lock = threading.Lock()
+        # Stack of the kernels running in each thread, so the recursive calls of the batch shards are not counted twice
+        self.local = threading.local()
+        self.previous = None
+        self.started_tracemalloc = False
+
+    def __enter__(self):
+        global active_profiler
+        self.previous = active_profiler
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        active_profiler = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global active_profiler
+        active_profiler = self.previous
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+        if self.print_report:
+            print(self.report())
+        if self.path:
+            self.save(self.path)
+        return False
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def profiled(*args, **kwargs):
+            with self:
+                return function(*args, **kwargs)
+        return profiled
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def inherit(self, function):
+        """
+        Wraps a function that runs in a worker thread so that it sees the kernels of the calling thread as running.
+        """
+
+        # Copies of the frames, the self time and the peak of a call only count its own thread
+        parent = [{"name": frame["name"], "children": 0., "peak": 0} for frame in self.stack()]
+        def inherited(*args, **kwargs):
+            stack = self.stack()
+            saved = stack[:]
+            stack[:] = parent
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stack[:] = saved
+        return inherited
+
+    def call(self, name, function, flops, args, kwargs):
+        """
+        Runs function(*args, **kwargs) and records it under name.
+        """
+
+        stack = self.stack()
+        if any(frame["name"] == name for frame in stack):
+            # A shard (or a tile) of a call that is already being recorded
+            return function(*args, **kwargs)
+
+        frame = {"name": name, "children": 0., "peak": 0}
+        if self.memory:
+            (start_memory, outer_peak) = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], outer_peak)
+            tracemalloc.reset_peak()
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+        if stack:
+            stack[-1]["children"] += elapsed
+
+        peak_bytes = None
+        if self.memory:
+            # The nested calls reset the peak, the frame keeps the highest peak seen before them
+            peak = max(tracemalloc.get_traced_memory()[1], frame["peak"])
+            peak_bytes = peak - start_memory
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+
+        # The arrays of the arguments, and of the caches given to the backward passes
+        arrays = [arg for arg in args if isinstance(arg, np.ndarray)]
+        arrays += [item for arg in args if isinstance(arg, tuple) for item in arg if isinstance(item, np.ndarray)]
+        shapes = tuple(array.shape for array in arrays)
+        outputs = result if isinstance(result, tuple) else (result,)
+        output_bytes = sum(output.nbytes for output in outputs if isinstance(output, np.ndarray))
+        operations = flops(args, result) if flops is not None else 0
+
+        with self.lock:
+            stats = self.stats.get((name, shapes))
+            if stats is None:
+                stats = {"kernel": name, "shapes": [list(shape) for shape in shapes], "calls": 0, "total_s": 0.,
+                         "self_s": 0., "min_s": None, "flop": 0., "output_bytes": 0, "peak_bytes": None}
+                self.stats[(name, shapes)] = stats
+            stats["calls"] += 1
+            stats["total_s"] += elapsed
+            stats["self_s"] += elapsed - frame["children"]
+            stats["min_s"] = elapsed if stats["min_s"] is None else min(stats["min_s"], elapsed)
+            stats["flop"] += operations
+            stats["output_bytes"] += output_bytes
+            if peak_bytes is not None:
+                stats["peak_bytes"] = max(stats["peak_bytes"] or 0, peak_bytes)
+
+        return result
+
+    def summary(self):
+        """
+        Returns:
+        summary -- dictionary with "calls", the statistics of every (kernel, input shapes) sorted by self time,
+                   and "kernels", the same statistics summed per kernel
+        """
+
+        with self.lock:
+            calls = [dict(stats) for stats in self.stats.values()]
+        calls.sort(key=lambda stats: stats["self_s"], reverse=True)
+
+        kernels = {}
+        for stats in calls:
+            stats["gflops"] = stats["flop"]/stats["total_s"]/1e9 if stats["total_s"] > 0 else 0.
+            kernel = kernels.setdefault(stats["kernel"], {"calls": 0, "total_s": 0., "self_s": 0., "flop": 0.})
+            for key in ("calls", "total_s", "self_s", "flop"):
+                kernel[key] += stats[key]
+
+        total_self = sum(kernel["self_s"] for kernel in kernels.values())
+        for kernel in kernels.values():
+            kernel["self_percent"] = 100.*kernel["self_s"]/total_self if total_self > 0 else 0.
+
+        return {"calls": calls, "kernels": kernels}
+
+    def report(self):
+        """
+        Returns:
+        report -- string, one line per kernel then one line per (kernel, input shapes)
+        """
+
+        summary = self.summary()
+        lines = ["%-14s %8s %10s %10s %7s" % ("kernel", "calls", "total s", "self s", "self %")]
+        for (name, kernel) in sorted(summary["kernels"].items(), key=lambda item: item[1]["self_s"], reverse=True):
+            lines.append("%-14s %8d %10.3f %10.3f %6.1f%%" % (name, kernel["calls"], kernel["total_s"], kernel["self_s"],
+                                                           kernel["self_percent"]))
+        lines.append("")
+        lines.append("%-14s %-40s %7s %10s %10s %8s %9s %9s" % ("kernel", "input shapes", "calls", "total s", "mean ms",
+                                                             "GFLOP/s", "out MB", "peak MB"))
+        for stats in summary["calls"]:
+            peak = "%9.1f" % (stats["peak_bytes"]/2.**20) if stats["peak_bytes"] is not None else "%9s" % "-"
+            lines.append("%-14s %-40s %7d %10.3f %10.3f %8.2f %9.1f %s" % (
+                stats["kernel"], " ".join("x".join(str(n) for n in shape) for shape in stats["shapes"]),
+                stats["calls"], stats["total_s"], 1e3*stats["total_s"]/stats["calls"], stats["gflops"],
+                stats["output_bytes"]/2.**20, peak))
+
+        return "\n".join(lines)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+# The Profiler the kernels report to, None when profiling is off
+active_profiler = None
+
+
+def profile_kernel(flops=None):
+    """
+    Decorator of the kernels recorded by an active Profiler.
+
+    Arguments:
+    flops -- optional function of (args, result) estimating the floating point operations of a call
+    """
+
+    def decorator(function):
+        name = function.__name__
+        @functools.wraps(function)
+        def kernel(*args, **kwargs):
+            profiler = active_profiler
+            if profiler is None:
+                return function(*args, **kwargs)
+            return profiler.call(name, function, flops, args, kwargs)
+        return kernel
+
+    return decorator
+
+
+def conv_forward_flops(args, result):
+    # One multiply-add per filter weight and output value
+    (Z, W) = (result[0], args[1])
+    return 2.0*Z.size*W.shape[0]*W.shape[1]*W.shape[2]
+
+
+def conv_backward_flops(args, result):
+    # dA_prev and dW, each as expensive as the forward pass
+    (dZ, W) = (args[0], args[1][1])
+    return 4.0*dZ.size*W.shape[0]*W.shape[1]*W.shape[2]
+
+
+def pool_forward_flops(args, result):
+    # One comparison (or addition) per window entry
+    f = args[1]["f"]
+    return float(result[0].size*f*f)
+
+
+def pool_backward_flops(args, result):
+    f = args[1][1]["f"]
+    return float(args[0].size*f*f)
+
+
+@profile_kernel()
+def zero_pad(X, pad, out=None):
     """
     Pad with zeros all images of the dataset X. The padding is applied to the height and width of an image,
     as illustrated in Figure 1.
@@ -6,16 +368,111 @@ def zero_pad(X, pad):
     Argument:
     X -- python numpy array of shape (m, n_H, n_W, n_C) representing a batch of m images
     pad -- integer, amount of padding around each image on vertical and horizontal dimensions
+    out -- optional array of shape (m, n_H + 2*pad, n_W + 2*pad, n_C) whose border is already zero,
+           only its interior is written. A buffer that is always padded the same way keeps its zero border.
 
     Returns:
     X_pad -- padded image of shape (m, n_H + 2*pad, n_W + 2*pad, n_C)
     """
 
-    X_pad = np.pad(X, ((0, 0), (pad, pad), (pad, pad), (0, 0)), "constant")
+    if out is None:
+        if pad == 0:
+            return X
+        X_pad = np.pad(X, ((0, 0), (pad, pad), (pad, pad), (0, 0)), "constant")
+    else:
+        (m, n_H, n_W, n_C) = X.shape
+        X_pad = out
+        X_pad[:, pad:pad + n_H, pad:pad + n_W, :] = X
 
     return X_pad
 
 
+def workspace_pad(workspace, X, pad, name):
+    """
+    zero_pad() into a persistent buffer of workspace, the buffer name includes pad so its border stays zero.
+    """
+
+    if workspace is None or pad == 0:
+        return zero_pad(X, pad)
+
+    (m, n_H, n_W, n_C) = X.shape
+    out = workspace.empty(name + "/pad=" + str(pad), (m, n_H + 2*pad, n_W + 2*pad, n_C), X.dtype)
+
+    return zero_pad(X, pad, out=out)
+
+
+def batch_slices(m, n_jobs):
+    """
+    Splits the batch dimension in contiguous shards of (almost) the same size, one per worker.
+
+    Arguments:
+    m -- integer, number of examples in the batch
+    n_jobs -- integer, number of workers, -1 uses every core of the machine
+
+    Returns:
+    slices -- list of at most n_jobs slice objects covering range(m)
+    """
+
+    if n_jobs is None or n_jobs == 0:
+        n_jobs = 1
+    elif n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    n_shards = max(1, min(n_jobs, m))
+
+    bounds = [int(k*m/n_shards) for k in range(n_shards + 1)]
+    slices = [slice(bounds[k], bounds[k + 1]) for k in range(n_shards)]
+
+    return slices
+
+
+# One thread pool per worker count, created the first time it is needed and reused by every call
+SHARD_EXECUTORS = {}
+SHARD_EXECUTORS_LOCK = threading.Lock()
+
+
+def map_shards(function, slices):
+    """
+    Runs function(index, batch_slice) for every shard on a thread pool and waits for all of them.
+    Threads are enough because numpy releases the GIL inside BLAS, the ufunc loops and the array copies.
+    numpy's BLAS may start its own threads too, with many shards set OMP_NUM_THREADS (or OPENBLAS_NUM_THREADS,
+    MKL_NUM_THREADS) to 1 so the cores are not oversubscribed.
+
+    Arguments:
+    function -- function of (index, batch_slice)
+    slices -- list of slices, output of batch_slices()
+
+    Returns:
+    results -- list of the results of function, in the order of slices
+    """
+
+    if len(slices) == 1:
+        return [function(0, slices[0])]
+
+    with SHARD_EXECUTORS_LOCK:
+        executor = SHARD_EXECUTORS.get(len(slices))
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=len(slices))
+            SHARD_EXECUTORS[len(slices)] = executor
+
+    profiler = active_profiler
+    if profiler is not None:
+        function = profiler.inherit(function)
+    futures = [executor.submit(function, index, batch_slice) for (index, batch_slice) in enumerate(slices)]
+
+    return [future.result() for future in futures]
+
+
+def shard_workspace(workspace, index):
+    """
+    Child workspace of the index-th shard, None when there is no workspace.
+    """
+
+    if workspace is None:
+        return None
+
+    return workspace.shard(index)
+
+
 def conv_single_step(a_slice_prev, W, b):
     """
     Apply one filter defined by parameters W on a single slice (a_slice_prev) of the output activation
@@ -27,66 +484,715 @@ def conv_single_step(a_slice_prev, W, b):
     b -- Bias parameters contained in a window - matrix of shape (1, 1, 1)
 
     Returns:
-    Z -- a scalar value, result of convolving the sliding window (W, b) on a slice x of the input data
+    Z -- a scalar value, result of convolving the sliding window (W, b) on a slice x of the input data
+    """
+
+    # Element-wise product between a_slice and W.
+    s = a_slice_prev * W
+    Z = np.sum(s)
+    # Squeeze b so that Z results in a scalar value. Casting it with float() would turn float32 results into float64
+    Z = Z + np.squeeze(b)
+
+    return Z
+
+def get_windows(A, f, stride, dilation=1):
+    """
+    Builds a read-only view over every f x f window of A. No data is copied, the windows share
+    the memory of A through numpy strides.
+
+    Arguments:
+    A -- numpy array of shape (m, n_H_prev, n_W_prev, n_C)
+    f -- integer, height and width of the window
+    stride -- integer, number of pixels between two consecutive windows
+    dilation -- integer, number of pixels between two consecutive entries of a window (1 for a dense window)
+
+    Returns:
+    windows -- view of A of shape (m, n_H, n_W, f, f, n_C) where windows[i, h, w] is
+               A[i, h*stride:h*stride+(f-1)*dilation+1:dilation, w*stride:w*stride+(f-1)*dilation+1:dilation, :]
+    """
+
+    (m, n_H_prev, n_W_prev, n_C) = A.shape
+    f_dilated = (f - 1)*dilation + 1
+    n_H = int((n_H_prev - f_dilated)/stride)+1
+    n_W = int((n_W_prev - f_dilated)/stride)+1
+
+    (s_m, s_H, s_W, s_C) = A.strides
+    windows = as_strided(A, shape=(m, n_H, n_W, f, f, n_C),
+                         strides=(s_m, s_H*stride, s_W*stride, s_H*dilation, s_W*dilation, s_C), writeable=False)
+
+    return windows
+
+
+def im2col(A_prev_pad, f, stride, out=None, dilation=1, groups=1):
+    """
+    Unrolls every f x f x n_C_prev patch of A_prev_pad into one row of a column matrix, so that a
+    convolution becomes a single matrix product with the reshaped filters.
+
+    Arguments:
+    A_prev_pad -- padded activations, numpy array of shape (m, n_H_prev + 2*pad, n_W_prev + 2*pad, n_C_prev)
+    f -- integer, size of the filters
+    stride -- integer, stride of the convolution
+    out -- optional contiguous array of the shape of cols to write the patches into
+    dilation -- integer, dilation of the filters
+    groups -- integer, number of groups of channels. Every group gets its own column matrix,
+              made of the patches of its n_C_prev/groups channels.
+
+    Returns:
+    cols -- numpy array of shape (m*n_H*n_W, f*f*n_C_prev), the rows follow the (i, h, w) order of Z.
+            With groups > 1, numpy array of shape (groups, m*n_H*n_W, f*f*n_C_prev/groups).
+    """
+
+    windows = get_windows(A_prev_pad, f, stride, dilation)
+    (m, n_H, n_W) = windows.shape[:3]
+
+    if groups > 1:
+        # (m, n_H, n_W, f, f, groups, n_C_prev/groups) -> (groups, m, n_H, n_W, f, f, n_C_prev/groups)
+        windows = windows.reshape(windows.shape[:5] + (groups, -1)).transpose(5, 0, 1, 2, 3, 4, 6)
+
+    # The windows are not contiguous so this is the one copy of the patches
+    if out is None:
+        cols = np.ascontiguousarray(windows)
+    else:
+        cols = out
+        np.copyto(cols.reshape(windows.shape), windows)
+
+    if groups > 1:
+        return cols.reshape(groups, m*n_H*n_W, -1)
+
+    return cols.reshape(m*n_H*n_W, -1)
+
+
+def group_matrix(X, groups):
+    """
+    View of a matrix whose columns are split in groups of consecutive columns as one matrix per group.
+
+    Arguments:
+    X -- numpy array of shape (rows, groups*k)
+    groups -- integer, number of groups
+
+    Returns:
+    X_groups -- view of X of shape (groups, rows, k)
+    """
+
+    return X.reshape(X.shape[0], groups, X.shape[1]//groups).transpose(1, 0, 2)
+
+
+def grouped_dot(X, Y, out, workspace, name):
+    """
+    One matrix product per group, written side by side in the columns of out, the inverse of group_matrix().
+
+    Arguments:
+    X -- numpy array of shape (groups, rows, n)
+    Y -- numpy array of shape (groups, n, k)
+    out -- contiguous array of shape (rows, groups*k)
+    workspace -- optional Workspace to borrow the per-group products from
+    name -- name of that buffer
+
+    Returns:
+    out
+    """
+
+    (groups, rows, n) = X.shape
+    if groups == 1:
+        return np.dot(X[0], Y[0], out=out)
+
+    products = np.matmul(X, Y, out=workspace_empty(workspace, name, (groups, rows, Y.shape[2]), out.dtype))
+    np.copyto(group_matrix(out, groups), products)
+
+    return out
+
+
+def conv_forward_loop(A_prev_pad, W, b, stride, n_H, n_W, workspace=None, dilation=1, groups=1):
+    """
+    Reference convolution, computes one output neuron at a time with conv_single_step.
+    It is very slow, keep it to check the results of the vectorized algorithms.
+
+    Arguments:
+    A_prev_pad -- padded activations, numpy array of shape (m, n_H_prev + 2*pad, n_W_prev + 2*pad, n_C_prev)
+    W -- Weights, numpy array of shape (f, f, n_C_prev/groups, n_C)
+    b -- Biases, numpy array of shape (1, 1, 1, n_C)
+    stride -- integer, stride of the convolution
+    n_H, n_W -- integers, height and width of the output volume
+    workspace -- optional Workspace to borrow the output and temporary buffers from
+    dilation -- integer, dilation of the filters
+    groups -- integer, number of groups of channels, the filter c only sees the input channels of its group
+
+    Returns:
+    Z -- conv output, numpy array of shape (m, n_H, n_W, n_C)
+    """
+
+    m = A_prev_pad.shape[0]
+    (f, f, n_C_group, n_C) = W.shape
+    f_dilated = (f - 1)*dilation + 1
+
+    # Initialize the output volume Z with zeros. (≈1 line)
+    Z = workspace_zeros(workspace, "loop/Z", (m, n_H, n_W, n_C), compute_dtype(A_prev_pad, W))
+
+    for i in range(m):                                 # loop over the batch of training examples
+        a_prev_pad = A_prev_pad[i]                     # Select ith training example's padded activation
+        #this should have for every example the height, width and the component deep
+        for h in range(n_H):                           # loop over vertical axis of the output volume
+            for w in range(n_W):                       # loop over horizontal axis of the output volume
+                for c in range(n_C):                   # loop over channels (= #filters) of the output volume
+                    vert_start = h*stride
+                    vert_end = vert_start + f_dilated
+                    horiz_start = w*stride
+                    horiz_end = horiz_start + f_dilated
+                    # Input channels of the group of the filter c
+                    channel_start = (c//(n_C//groups))*n_C_group
+                    channel_end = channel_start + n_C_group
+
+                    a_slice_prev = a_prev_pad[vert_start:vert_end:dilation, horiz_start:horiz_end:dilation, channel_start:channel_end]
+                    # Convolve the (3D) slice with the correct filter W and bias b, to get back one output neuron.
+                    Z[i, h, w, c] = conv_single_step(a_slice_prev, W[:, :, :, c], b[:, :, :, c])
+
+    return Z
+
+
+def conv_forward_im2col(A_prev_pad, W, b, stride, n_H, n_W, workspace=None, dilation=1, groups=1):
+    """
+    Vectorized convolution, unrolls the patches with im2col and computes the whole layer as one
+    matrix product (BLAS gemm), or one matrix product per group of channels.
+
+    Arguments:
+    A_prev_pad -- padded activations, numpy array of shape (m, n_H_prev + 2*pad, n_W_prev + 2*pad, n_C_prev)
+    W -- Weights, numpy array of shape (f, f, n_C_prev/groups, n_C)
+    b -- Biases, numpy array of shape (1, 1, 1, n_C)
+    stride -- integer, stride of the convolution
+    n_H, n_W -- integers, height and width of the output volume
+    workspace -- optional Workspace to borrow the output and temporary buffers from
+    dilation -- integer, dilation of the filters
+    groups -- integer, number of groups of channels
+
+    Returns:
+    Z -- conv output, numpy array of shape (m, n_H, n_W, n_C)
+    """
+
+    m = A_prev_pad.shape[0]
+    (f, f, n_C_group, n_C) = W.shape
+    rows = m*n_H*n_W
+    dtype = compute_dtype(A_prev_pad, W)
+
+    cols_shape = (rows, f*f*n_C_group) if groups == 1 else (groups, rows, f*f*n_C_group)
+    cols = im2col(A_prev_pad, f, stride, workspace_empty(workspace, "im2col/cols", cols_shape, dtype), dilation, groups)
+    # (m*n_H*n_W, f*f*n_C_prev) x (f*f*n_C_prev, n_C), W is flattened in the same (f, f, n_C_prev) order as the patches
+    W_flat = W.reshape(f*f*n_C_group, n_C).astype(dtype, copy=False)
+    Z = grouped_dot(cols.reshape(groups, rows, -1), group_matrix(W_flat, groups),
+                    workspace_empty(workspace, "im2col/Z", (rows, n_C), dtype), workspace, "im2col/Z_groups")
+    Z += b.reshape(n_C)
+
+    return Z.reshape(m, n_H, n_W, n_C)
+
+
+def conv_forward_1x1(A_prev_pad, W, b, stride, n_H, n_W, workspace=None, dilation=1, groups=1):
+    """
+    Convolution with 1x1 filters, a matrix product over the channels of every (strided) pixel.
+    There are no patches to unroll: with stride 1 the input is multiplied in place.
+
+    Arguments:
+    A_prev_pad -- padded activations, numpy array of shape (m, n_H_prev + 2*pad, n_W_prev + 2*pad, n_C_prev)
+    W -- Weights, numpy array of shape (1, 1, n_C_prev/groups, n_C)
+    b -- Biases, numpy array of shape (1, 1, 1, n_C)
+    stride -- integer, stride of the convolution
+    n_H, n_W -- integers, height and width of the output volume
+    workspace -- optional Workspace to borrow the output and temporary buffers from
+    dilation -- integer, has no effect on a 1x1 filter
+    groups -- integer, number of groups of channels
+
+    Returns:
+    Z -- conv output, numpy array of shape (m, n_H, n_W, n_C)
+    """
+
+    (f, f, n_C_group, n_C) = W.shape
+    if f != 1:
+        raise ValueError("1x1 only supports 1x1 filters")
+
+    (m, n_H_pad, n_W_pad, n_C_prev) = A_prev_pad.shape
+    rows = m*n_H*n_W
+    dtype = compute_dtype(A_prev_pad, W)
+
+    pixels = A_prev_pad[:, 0:(n_H - 1)*stride + 1:stride, 0:(n_W - 1)*stride + 1:stride, :]
+    if pixels.flags.c_contiguous and pixels.dtype == dtype:
+        cols = pixels.reshape(rows, n_C_prev)
+    else:
+        # Strided pixels (or another dtype) are gathered once
+        cols = workspace_empty(workspace, "1x1/cols", (rows, n_C_prev), dtype)
+        np.copyto(cols.reshape(m, n_H, n_W, n_C_prev), pixels)
+
+    W_flat = W.reshape(n_C_group, n_C).astype(dtype, copy=False)
+    Z = grouped_dot(group_matrix(cols, groups), group_matrix(W_flat, groups),
+                    workspace_empty(workspace, "1x1/Z", (rows, n_C), dtype), workspace, "1x1/Z_groups")
+    Z += b.reshape(n_C)
+
+    return Z.reshape(m, n_H, n_W, n_C)
+
+
+# Winograd F(2x2, 3x3) transforms (Lavin & Gray), Y = A_T [(G g G_T) * (B_T d B)] A.
+WINOGRAD_B_T = np.array([[1, 0, -1, 0],
+                         [0, 1, 1, 0],
+                         [0, -1, 1, 0],
+                         [0, 1, 0, -1]], dtype=np.float64)
+WINOGRAD_G = np.array([[1, 0, 0],
+                       [0.5, 0.5, 0.5],
+                       [0.5, -0.5, 0.5],
+                       [0, 0, 1]], dtype=np.float64)
+WINOGRAD_A_T = np.array([[1, 1, 1, 0],
+                         [0, 1, -1, -1]], dtype=np.float64)
+# The 2D transforms of a flattened tile, B_T d B is (B_T kron B_T) vec(d), G g G_T is (G kron G) vec(g) and
+# A_T M A is (A_T kron A_T) vec(M), so each one is a single matrix product over all the tiles and channels
+WINOGRAD_INPUT_TRANSFORM = np.kron(WINOGRAD_B_T, WINOGRAD_B_T)
+WINOGRAD_FILTER_TRANSFORM = np.kron(WINOGRAD_G, WINOGRAD_G)
+WINOGRAD_OUTPUT_TRANSFORM = np.kron(WINOGRAD_A_T, WINOGRAD_A_T)
+
+
+def conv_forward_winograd(A_prev_pad, W, b, stride, n_H, n_W, workspace=None, dilation=1, groups=1):
+    """
+    Winograd F(2x2, 3x3) convolution, only for 3x3 filters with stride 1.
+    Every 2x2 output tile is computed from a 4x4 input tile with 16 multiplications instead of 36,
+    the products over the channels become 16 matrix products of (tiles, n_C_prev) x (n_C_prev, n_C).
+
+    Arguments:
+    A_prev_pad -- padded activations, numpy array of shape (m, n_H_prev + 2*pad, n_W_prev + 2*pad, n_C_prev)
+    W -- Weights, numpy array of shape (3, 3, n_C_prev, n_C)
+    b -- Biases, numpy array of shape (1, 1, 1, n_C)
+    stride -- integer, stride of the convolution, must be 1
+    n_H, n_W -- integers, height and width of the output volume
+    workspace -- optional Workspace to borrow the output and temporary buffers from
+    dilation, groups -- must be 1
+
+    Returns:
+    Z -- conv output, numpy array of shape (m, n_H, n_W, n_C)
+    """
+
+    (f, f, n_C_prev, n_C) = W.shape
+    if f != 3 or stride != 1 or dilation != 1 or groups != 1:
+        raise ValueError("winograd only supports 3x3 filters with stride 1, no dilation and no groups")
+
+    m = A_prev_pad.shape[0]
+    dtype = compute_dtype(A_prev_pad, W)
+    A_prev_pad = A_prev_pad.astype(dtype, copy=False)
+
+    # Number of 2x2 output tiles, pad the input at the bottom/right so every tile has its 4x4 input
+    t_H = (n_H + 1)//2
+    t_W = (n_W + 1)//2
+    extra_H = 2*t_H + 2 - A_prev_pad.shape[1]
+    extra_W = 2*t_W + 2 - A_prev_pad.shape[2]
+    if extra_H > 0 or extra_W > 0:
+        A_prev_pad = np.pad(A_prev_pad, ((0, 0), (0, max(extra_H, 0)), (0, max(extra_W, 0)), (0, 0)), "constant")
+
+    # Input tiles, 4x4 windows with stride 2, gathered once with the 16 positions of the tile first:
+    # (16, tiles*n_C_prev)
+    tiles = m*t_H*t_W
+    d = workspace_empty(workspace, "winograd/d", (4, 4, m, t_H, t_W, n_C_prev), dtype)
+    np.copyto(d, get_windows(A_prev_pad, 4, 2)[:, :t_H, :t_W].transpose(3, 4, 0, 1, 2, 5))
+
+    # Transform the input tiles to the winograd domain, V = B_T d B, (16, tiles, n_C_prev)
+    V = workspace_empty(workspace, "winograd/V", (16, tiles, n_C_prev), dtype)
+    np.dot(WINOGRAD_INPUT_TRANSFORM.astype(dtype), d.reshape(16, tiles*n_C_prev), out=V.reshape(16, tiles*n_C_prev))
+
+    # Filters in the winograd domain, U = G g G_T, (16, n_C_prev, n_C)
+    U = workspace_empty(workspace, "winograd/U", (16, n_C_prev, n_C), dtype)
+    np.dot(WINOGRAD_FILTER_TRANSFORM.astype(dtype), W.astype(dtype, copy=False).reshape(9, n_C_prev*n_C),
+           out=U.reshape(16, n_C_prev*n_C))
+
+    # One (tiles, n_C_prev) x (n_C_prev, n_C) product for each of the 16 positions of the tile. np.dot goes to
+    # BLAS for any n_C_prev, a stacked np.matmul does not when n_C_prev is small (grayscale inputs)
+    M = workspace_empty(workspace, "winograd/M", (16, tiles, n_C), dtype)
+    for position in range(16):
+        np.dot(V[position], U[position], out=M[position])
+
+    # Back to the 2x2 output tiles, Y = A_T M A, (2, 2, m, t_H, t_W, n_C)
+    Y = workspace_empty(workspace, "winograd/Y", (2, 2, m, t_H, t_W, n_C), dtype)
+    np.dot(WINOGRAD_OUTPUT_TRANSFORM.astype(dtype), M.reshape(16, tiles*n_C), out=Y.reshape(4, tiles*n_C))
+
+    # (2, 2, m, t_H, t_W, n_C) -> (m, t_H, 2, t_W, 2, n_C)
+    Y = Y.transpose(2, 3, 0, 4, 1, 5).reshape(m, 2*t_H, 2*t_W, n_C)
+    Z = workspace_empty(workspace, "winograd/Z", (m, n_H, n_W, n_C), dtype)
+    np.add(Y[:, :n_H, :n_W, :], b.reshape(n_C), out=Z)
+
+    return Z
+
+
+def conv_forward_fft(A_prev_pad, W, b, stride, n_H, n_W, workspace=None, dilation=1, groups=1):
+    """
+    FFT convolution, worth it for large filters (5x5, 7x7) where the direct algorithms do f*f times more work.
+    The cross-correlation of every channel is a product in the frequency domain, summed over the input
+    channels with one matrix product per frequency. Strides > 1 are computed at stride 1 and subsampled, stride**2
+    times the work, so conv_forward_candidates() only offers it for stride 1.
+
+    Arguments:
+    A_prev_pad -- padded activations, numpy array of shape (m, n_H_prev + 2*pad, n_W_prev + 2*pad, n_C_prev)
+    W -- Weights, numpy array of shape (f, f, n_C_prev, n_C)
+    b -- Biases, numpy array of shape (1, 1, 1, n_C)
+    stride -- integer, stride of the convolution
+    n_H, n_W -- integers, height and width of the output volume
+    workspace -- optional Workspace to borrow the output and temporary buffers from
+    dilation, groups -- must be 1
+
+    Returns:
+    Z -- conv output, numpy array of shape (m, n_H, n_W, n_C)
+    """
+
+    if dilation != 1 or groups != 1:
+        raise ValueError("fft does not support dilation or groups")
+
+    (m, n_H_pad, n_W_pad, n_C_prev) = A_prev_pad.shape
+    (f, f, n_C_prev, n_C) = W.shape
+    shape = (n_H_pad, n_W_pad)
+    dtype = compute_dtype(A_prev_pad, W)
+    A_prev_pad = A_prev_pad.astype(dtype, copy=False)
+    W = W.astype(dtype, copy=False)
+
+    # Spectra of the images and of the filters (zero padded to the image size). NumPy < 2 always returns
+    # complex128, the product over the channels runs in the complex dtype matching dtype
+    complex_dtype = np.result_type(dtype, np.complex64)
+    A_fft = np.fft.rfft2(A_prev_pad, s=shape, axes=(1, 2)).astype(complex_dtype, copy=False)
+    W_fft = np.fft.rfft2(W, s=shape, axes=(0, 1)).astype(complex_dtype, copy=False)
+    n_F = A_fft.shape[2]
+
+    # Cross-correlation is a product with the conjugate of the filter spectrum.
+    # (freq, m, n_C_prev) x (freq, n_C_prev, n_C) -> (freq, m, n_C)
+    A_fft = A_fft.transpose(1, 2, 0, 3).reshape(n_H_pad*n_F, m, n_C_prev)
+    W_fft = np.conj(W_fft).reshape(n_H_pad*n_F, n_C_prev, n_C)
+    Z_fft = np.matmul(A_fft, W_fft).reshape(n_H_pad, n_F, m, n_C).transpose(2, 0, 1, 3)
+
+    # The valid (non circular) outputs are the first n_H_pad - f + 1 positions
+    Z_full = np.fft.irfft2(Z_fft, s=shape, axes=(1, 2))
+    Z = workspace_empty(workspace, "fft/Z", (m, n_H, n_W, n_C), dtype)
+    np.add(Z_full[:, 0:(n_H - 1)*stride + 1:stride, 0:(n_W - 1)*stride + 1:stride, :], b.reshape(n_C), out=Z)
+
+    return Z
+
+
+CONV_FORWARD_ALGORITHMS = {"im2col": conv_forward_im2col,
+                           "1x1": conv_forward_1x1,
+                           "winograd": conv_forward_winograd,
+                           "fft": conv_forward_fft,
+                           "loop": conv_forward_loop}
+
+
+def conv_forward_candidates(f, stride, dilation=1, groups=1):
+    """
+    Lists the algorithms of CONV_FORWARD_ALGORITHMS that can run a layer, the loop reference is never one of them.
+
+    Arguments:
+    f -- integer, size of the filters
+    stride -- integer, stride of the convolution
+    dilation -- integer, dilation of the filters
+    groups -- integer, number of groups of channels
+
+    Returns:
+    candidates -- list of algorithm names
+    """
+
+    # Nothing beats a single matrix product without any unrolling
+    if f == 1:
+        return ["1x1"]
+
+    candidates = ["im2col"]
+    # fft computes every stride 1 output and subsamples, with stride > 1 it wastes stride**2 times the work
+    if dilation == 1 and groups == 1 and stride == 1:
+        candidates.append("fft")
+        if f == 3:
+            candidates.append("winograd")
+
+    return candidates
+
+
+def conv_backward_candidates(f, stride, dilation=1, groups=1):
+    """
+    Lists the algorithms of CONV_BACKWARD_ALGORITHMS that can run a layer, the loop reference is never one of them.
+
+    Arguments:
+    f -- integer, size of the filters
+    stride -- integer, stride of the convolution
+    dilation -- integer, dilation of the filters
+    groups -- integer, number of groups of channels
+
+    Returns:
+    candidates -- list of algorithm names
+    """
+
+    if f == 1:
+        return ["1x1"]
+
+    # The sparse pass runs on any layer, its speed depends on the density of dZ (part of the backward keys)
+    return ["col2im", "sparse"]
+
+
+class ConvAutotuner(object):
+    """
+    Picks the fastest convolution algorithm for every layer shape, like cudnn.benchmark.
+
+    The first call with a new (direction, input shape, filter shape, stride, pad, dtype, dilation, groups) key,
+    plus the density of dZ in steps of 0.1 for the backward pass, times every candidate once on the real input and returns the result of the fastest one. The choice is kept
+    in memory and in a json file of the user's cache directory, so later calls and later runs use it without
+    timing anything again.
+    """
+
+    def __init__(self, path=None):
+        """
+        Arguments:
+        path -- json file where the choices are stored, defaults to the CONV_AUTOTUNE_CACHE environment
+                variable or to conv_autotune.json in $XDG_CACHE_HOME/iaplayground (~/.cache/iaplayground).
+                An empty string keeps the choices in memory only.
+        """
+
+        if path is None:
+            path = os.environ.get("CONV_AUTOTUNE_CACHE")
+        if path is None:
+            cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+            path = os.path.join(cache_home, "iaplayground", "conv_autotune.json")
+        self.path = path
+        self.choices = None
+        # Batch-sharded calls run the same key from several threads, only one of them times the candidates
+        self.lock = threading.Lock()
+
+    def key(self, direction, A_shape, W_shape, stride, pad, dtype, dilation=1, groups=1, density=None):
+        key = "%s|A%s|W%s|stride=%d|pad=%d|%s" % (direction, tuple(A_shape), tuple(W_shape), stride, pad, np.dtype(dtype).name)
+        # Only in the keys of dilated or grouped layers, so the choices of the other layers stay valid
+        if dilation != 1:
+            key += "|dilation=%d" % dilation
+        if groups != 1:
+            key += "|groups=%d" % groups
+        # The sparse backward pass gets faster as dZ gets sparser, its choice holds for one range of densities
+        if density is not None:
+            key += "|density=%.1f" % (np.ceil(density*10)/10.)
+        return key
+
+    def read(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            # A broken cache file only means the shapes are tuned again
+            return {}
+
+    def load(self):
+        if self.choices is None:
+            self.choices = self.read()
+        return self.choices
+
+    def save(self):
+        if not self.path:
+            return
+        # Merge with what other runs may have written since we loaded the file
+        choices = self.read()
+        choices.update(self.choices)
+        tmp_path = self.path + '.tmp'
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(tmp_path, 'w') as f:
+                json.dump(choices, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except (IOError, OSError):
+            # A cache that cannot be written only means the next run tunes again
+            pass
+
+    def run(self, key, candidates, algorithms, *args):
+        """
+        Runs the algorithm chosen for key, timing every candidate first if the key was never seen.
+
+        Arguments:
+        key -- string, output of key()
+        candidates -- list of algorithm names that can run this layer
+        algorithms -- dictionary name -> function, CONV_FORWARD_ALGORITHMS or CONV_BACKWARD_ALGORITHMS
+        args -- arguments of the algorithm functions
+
+        Returns:
+        result -- the output of the chosen algorithm
+        """
+
+        if len(candidates) == 1:
+            return algorithms[candidates[0]](*args)
+
+        algorithm = self.load().get(key)
+        if algorithm in candidates:
+            return algorithms[algorithm](*args)
+
+        with self.lock:
+            choices = self.load()
+            algorithm = choices.get(key)
+            if algorithm in candidates:
+                return algorithms[algorithm](*args)
+            return self.tune(key, candidates, algorithms, *args)
+
+    def tune(self, key, candidates, algorithms, *args):
+        """
+        Times every candidate once, records the fastest one for key and returns its result.
+        """
+
+        best_time = None
+        for name in candidates:
+            start = time.perf_counter()
+            result = algorithms[name](*args)
+            elapsed = time.perf_counter() - start
+            if best_time is None or elapsed < best_time:
+                best_time = elapsed
+                best_name = name
+                best_result = result
+
+        self.choices[key] = best_name
+        self.save()
+
+        return best_result
+
+
+default_autotuner = ConvAutotuner()
+
+
+def conv_pixel_bytes(W, n_C_prev, dtype, direction):
+    """
+    Estimates the temporary memory a convolution needs per output pixel: one row of unrolled patches and one
+    row of Z for the forward pass, the patches, their gradients and a row of dZ for the backward pass.
+
+    Arguments:
+    W -- Weights, numpy array of shape (f, f, n_C_prev/groups, n_C)
+    n_C_prev -- integer, number of input channels
+    dtype -- dtype the convolution computes in
+    direction -- "forward" or "backward"
+
+    Returns:
+    pixel_bytes -- integer, number of bytes
+    """
+
+    (f, f, n_C_group, n_C) = W.shape
+    row = f*f*n_C_prev
+    if direction == "backward":
+        row = 2*row
+
+    return (row + 2*n_C)*np.dtype(dtype).itemsize
+
+
+def conv_tiles(m, n_H, n_W, pixel_bytes, memory_budget):
+    """
+    Splits the output of a convolution in tiles whose temporary matrices fit in memory_budget bytes.
+    Whole examples are grouped as long as they fit, an example that does not fit is split in bands of
+    output rows. A tile has at least one output row, whatever the budget.
+
+    Arguments:
+    m, n_H, n_W -- integers, shape of the output volume
+    pixel_bytes -- integer, memory needed per output pixel, output of conv_pixel_bytes()
+    memory_budget -- integer, number of bytes a tile may use
+
+    Returns:
+    tiles -- list of (batch_slice, row_slice) indexing the output volume
+    """
+
+    pixels = max(int(memory_budget//pixel_bytes), 1)
+
+    if pixels >= n_H*n_W:
+        batch = pixels//(n_H*n_W)
+        return [(slice(i, min(i + batch, m)), slice(0, n_H)) for i in range(0, m, batch)]
+
+    rows = max(pixels//n_W, 1)
+    return [(slice(i, i + 1), slice(h, min(h + rows, n_H))) for i in range(m) for h in range(0, n_H, rows)]
+
+
+def conv_tile_input(A_prev_pad, tile, stride, f_dilated):
+    """
+    Part of the padded input seen by the outputs of tile. Neighbouring bands of rows overlap when f > stride.
+
+    Returns:
+    (batch_slice, row_slice) -- indices of the part in A_prev_pad
     """
 
-    # Element-wise product between a_slice and W.
-    s = a_slice_prev * W
-    Z = np.sum(s)
-    # Cast b to a float() so that Z results in a scalar value. squeeze would work too
-    Z = Z + float(b)
+    (batch_slice, row_slice) = tile
+
+    return batch_slice, slice(row_slice.start*stride, (row_slice.stop - 1)*stride + f_dilated)
 
-    return Z
 
-def conv_forward(A_prev, W, b, hparameters):
+@profile_kernel(conv_forward_flops)
+def conv_forward(A_prev, W, b, hparameters, algorithm="im2col", workspace=None, n_jobs=1, memory_budget=None):
     """
     Implements the forward propagation for a convolution function
 
     Arguments:
     A_prev -- output activations of the previous layer, numpy array of shape (m, n_H_prev, n_W_prev, n_C_prev)
-    W -- Weights, numpy array of shape (f, f, n_C_prev, n_C)
+    W -- Weights, numpy array of shape (f, f, n_C_prev/groups, n_C)
     b -- Biases, numpy array of shape (1, 1, 1, n_C)
-    hparameters -- python dictionary containing "stride" and "pad"
+    hparameters -- python dictionary containing "stride" and "pad", and optionally "dilation" (space between
+                   the entries of a filter, default 1) and "groups" (the input and output channels are split in
+                   groups convolved separately, default 1, n_C_prev for a depthwise convolution)
+    algorithm -- the convolution algorithm, one of CONV_FORWARD_ALGORITHMS: "im2col" (default),
+                 "winograd" (3x3 filters, stride 1), "fft" (large filters), "1x1" (1x1 filters)
+                 or "loop" (slow reference implementation).
+                 All of them give the same Z up to float rounding. "im2col" runs 1x1 filters with "1x1".
+                 "auto" lets default_autotuner pick the fastest one for this shape.
+    workspace -- optional Workspace, the padded input, the patches and Z are then written in its buffers
+                 instead of new arrays. Z is only valid until the next call with the same workspace.
+    n_jobs -- number of threads, the batch is split in n_jobs shards computed in parallel (-1 uses every core)
+    memory_budget -- optional number of bytes. The layer is then computed tile by tile (groups of examples,
+                     or bands of output rows of one example) so that the unrolled patches of a tile fit in
+                     memory_budget, the shards of n_jobs share it. Every output is computed from the same
+                     patches as without tiles: Z is identical, up to the last bit of rounding the BLAS may
+                     change with the size of the matrix products (grouped layers).
 
     Returns:
     Z -- conv output, numpy array of shape (m, n_H, n_W, n_C)
     cache -- cache of values needed for the conv_backward() function
     """
 
+    if algorithm != "auto" and algorithm not in CONV_FORWARD_ALGORITHMS:
+        raise ValueError("Unknown convolution algorithm: " + str(algorithm))
+
     # Retrieve dimensions from A_prev's shape (≈1 line)
     (m, n_H_prev, n_W_prev, n_C_prev) = A_prev.shape
 
     # Retrieve dimensions from W's shape (≈1 line)
-    (f, f, n_C_prev, n_C) = W.shape
+    (f, f, n_C_group, n_C) = W.shape
 
     # Retrieve information from "hparameters" (≈2 lines)
     stride = hparameters['stride']
     pad = hparameters['pad']
+    dilation = hparameters.get('dilation', 1)
+    groups = hparameters.get('groups', 1)
 
-    # Compute the dimensions of the CONV output volume using the formula given above. Hint: use int() to floor. (≈2 lines)
-    n_H = int((n_H_prev - f + 2*pad)/stride)+1
-    n_W = int((n_W_prev - f + 2*pad)/stride)+1
-
-    # Initialize the output volume Z with zeros. (≈1 line)
-    Z = np.zeros((m, n_H, n_W, n_C))
-
-    # Create A_prev_pad by padding A_prev
-    A_prev_pad = zero_pad(A_prev, pad)
+    if n_C_group*groups != n_C_prev or n_C % groups != 0:
+        raise ValueError("%d groups do not fit %d input channels, filters of shape %s" % (groups, n_C_prev, W.shape))
 
-    for i in range(m):                                 # loop over the batch of training examples
-        a_prev_pad = A_prev_pad[i]                     # Select ith training example's padded activation
-        #this should have for every example the height, width and the component deep
-        for h in range(n_H):                           # loop over vertical axis of the output volume
-            for w in range(n_W):                       # loop over horizontal axis of the output volume
-                for c in range(n_C):                   # loop over channels (= #filters) of the output volume
-                    vert_start = h*stride
-                    vert_end = vert_start + f
-                    horiz_start = w*stride
-                    horiz_end = horiz_start + f
+    # The 1x1 filters need no patches
+    if f == 1 and algorithm == "im2col":
+        algorithm = "1x1"
 
-                    a_slice_prev = a_prev_pad[vert_start:vert_end, horiz_start:horiz_end, :]
-                    # Convolve the (3D) slice with the correct filter W and bias b, to get back one output neuron.
-                    Z[i, h, w, c] = conv_single_step(a_slice_prev, W[:, :, :, c], b[:, :, :, c])
+    # Compute the dimensions of the CONV output volume using the formula given above. Hint: use int() to floor. (≈2 lines)
+    f_dilated = (f - 1)*dilation + 1
+    n_H = int((n_H_prev - f_dilated + 2*pad)/stride)+1
+    n_W = int((n_W_prev - f_dilated + 2*pad)/stride)+1
+
+    def compute(A_prev_pad, n_H, key_shape, key_pad):
+        if algorithm == "auto":
+            key = default_autotuner.key("forward", key_shape, W.shape, stride, key_pad, A_prev.dtype, dilation, groups)
+            return default_autotuner.run(key, conv_forward_candidates(f, stride, dilation, groups), CONV_FORWARD_ALGORITHMS,
+                                         A_prev_pad, W, b, stride, n_H, n_W, workspace, dilation, groups)
+        return CONV_FORWARD_ALGORITHMS[algorithm](A_prev_pad, W, b, stride, n_H, n_W, workspace, dilation, groups)
+
+    slices = batch_slices(m, n_jobs)
+    if len(slices) > 1:
+        # Every worker runs the whole layer on its part of the batch
+        shard_budget = memory_budget//len(slices) if memory_budget is not None else None
+        def forward_shard(index, batch_slice):
+            return conv_forward(A_prev[batch_slice], W, b, hparameters, algorithm, shard_workspace(workspace, index),
+                                memory_budget=shard_budget)[0]
+        Z_shards = map_shards(forward_shard, slices)
+        Z = workspace_empty(workspace, "shards/Z", (m, n_H, n_W, n_C), Z_shards[0].dtype)
+        np.concatenate(Z_shards, axis=0, out=Z)
+    elif memory_budget is not None:
+        A_prev_pad = workspace_pad(workspace, A_prev, pad, "A_prev_pad")
+        Z = workspace_empty(workspace, "tiled/Z", (m, n_H, n_W, n_C), compute_dtype(A_prev, W))
+        pixel_bytes = conv_pixel_bytes(W, n_C_prev, Z.dtype, "forward")
+        for tile in conv_tiles(m, n_H, n_W, pixel_bytes, memory_budget):
+            # A tile of the padded input is convolved without padding
+            A_tile = A_prev_pad[conv_tile_input(A_prev_pad, tile, stride, f_dilated)]
+            Z[tile] = compute(A_tile, tile[1].stop - tile[1].start, A_tile.shape, 0)
+    else:
+        # Create A_prev_pad by padding A_prev
+        A_prev_pad = workspace_pad(workspace, A_prev, pad, "A_prev_pad")
+        Z = compute(A_prev_pad, n_H, A_prev.shape, pad)
 
     # Making sure your output shape is correct
     assert(Z.shape == (m, n_H, n_W, n_C))
@@ -97,34 +1203,27 @@ def conv_forward(A_prev, W, b, hparameters):
     return Z, cache
 
 
-def pool_forward(A_prev, hparameters, mode = "max"):
+def pool_forward_loop(A_prev, f, stride, n_H, n_W, mode, workspace=None):
     """
-    Implements the forward pass of the pooling layer
+    Reference pooling, computes one output value at a time.
+    It is very slow, keep it to check the results of the vectorized algorithms.
 
     Arguments:
     A_prev -- Input data, numpy array of shape (m, n_H_prev, n_W_prev, n_C_prev)
-    hparameters -- python dictionary containing "f" and "stride"
+    f -- integer, size of the pooling window
+    stride -- integer, stride of the pooling window
+    n_H, n_W -- integers, height and width of the output volume
     mode -- the pooling mode you would like to use, defined as a string ("max" or "average")
+    workspace -- optional Workspace to borrow the output buffer from
 
     Returns:
     A -- output of the pool layer, a numpy array of shape (m, n_H, n_W, n_C)
-    cache -- cache used in the backward pass of the pooling layer, contains the input and hparameters
     """
 
-    # Retrieve dimensions from the input shape
-    (m, n_H_prev, n_W_prev, n_C_prev) = A_prev.shape
-
-    # Retrieve hyperparameters from "hparameters"
-    f = hparameters["f"]
-    stride = hparameters["stride"]
-
-    # Define the dimensions of the output
-    n_H = int(1 + (n_H_prev - f) / stride)
-    n_W = int(1 + (n_W_prev - f) / stride)
-    n_C = n_C_prev
+    (m, n_H_prev, n_W_prev, n_C) = A_prev.shape
 
     # Initialize output matrix A
-    A = np.zeros((m, n_H, n_W, n_C))
+    A = workspace_zeros(workspace, "loop/A", (m, n_H, n_W, n_C), compute_dtype(A_prev))
 
     for i in range(m):                         # loop over the training examples
         for h in range(n_H):                     # loop on the vertical axis of the output volume
@@ -146,8 +1245,150 @@ def pool_forward(A_prev, hparameters, mode = "max"):
                     elif mode == "average":
                         A[i, h, w, c] = np.mean(a_prev_slice)
 
-    # Store the input and hparameters in "cache" for pool_backward()
-    cache = (A_prev, hparameters)
+    return A
+
+
+def pool_forward_strided(A_prev, f, stride, n_H, n_W, mode, workspace=None):
+    """
+    Vectorized pooling, reduces all the windows at once over a read-only strided view of A_prev.
+    When the windows do not overlap (f == stride) the view is a plain reshape of A_prev.
+    Neither case copies the input.
+
+    Arguments:
+    A_prev -- Input data, numpy array of shape (m, n_H_prev, n_W_prev, n_C_prev)
+    f -- integer, size of the pooling window
+    stride -- integer, stride of the pooling window
+    n_H, n_W -- integers, height and width of the output volume
+    mode -- the pooling mode you would like to use, defined as a string ("max" or "average")
+    workspace -- optional Workspace to borrow the output buffer from
+
+    Returns:
+    A -- output of the pool layer, a numpy array of shape (m, n_H, n_W, n_C)
+    """
+
+    (m, n_H_prev, n_W_prev, n_C) = A_prev.shape
+
+    if f == stride:
+        # Drop the rows/columns that no window covers, then split each spatial axis in (n, f).
+        # Splitting an axis never needs a copy, so this is a view of A_prev.
+        windows = A_prev[:, :n_H*f, :n_W*f, :].reshape(m, n_H, f, n_W, f, n_C)
+        axis = (2, 4)
+    else:
+        windows = get_windows(A_prev, f, stride)
+        axis = (3, 4)
+
+    A = workspace_empty(workspace, "strided/A", (m, n_H, n_W, n_C), compute_dtype(A_prev))
+    if mode == "max":
+        windows.max(axis=axis, out=A)
+    elif mode == "average":
+        windows.mean(axis=axis, out=A)
+
+    return A
+
+
+def pool_argmax(A_prev, f, stride, n_H, n_W):
+    """
+    Finds the position of the max entry of every pooling window.
+
+    Arguments:
+    A_prev -- Input data, numpy array of shape (m, n_H_prev, n_W_prev, n_C_prev)
+    f -- integer, size of the pooling window
+    stride -- integer, stride of the pooling window
+    n_H, n_W -- integers, height and width of the output volume
+
+    Returns:
+    argmax -- numpy array of shape (m, n_H, n_W, n_C) with the flat index (into A_prev.ravel()) of the
+              max entry of each window. On ties the first entry of the window wins.
+    """
+
+    (m, n_H_prev, n_W_prev, n_C) = A_prev.shape
+
+    # (m, n_H, n_W, f*f, n_C), merging the two window axes copies the windows once
+    windows = get_windows(A_prev, f, stride).reshape(m, n_H, n_W, f*f, n_C)
+    k = windows.argmax(axis=3)
+
+    # Position of the max inside A_prev
+    i = np.arange(m).reshape(m, 1, 1, 1)
+    row = np.arange(n_H).reshape(1, n_H, 1, 1)*stride + k//f
+    col = np.arange(n_W).reshape(1, 1, n_W, 1)*stride + k%f
+    c = np.arange(n_C).reshape(1, 1, 1, n_C)
+    argmax = ((i*n_H_prev + row)*n_W_prev + col)*n_C + c
+
+    return argmax
+
+
+POOL_FORWARD_ALGORITHMS = {"strided": pool_forward_strided,
+                           "loop": pool_forward_loop}
+
+
+@profile_kernel(pool_forward_flops)
+def pool_forward(A_prev, hparameters, mode = "max", algorithm="strided", cache_argmax=False, workspace=None, n_jobs=1):
+    """
+    Implements the forward pass of the pooling layer
+
+    Arguments:
+    A_prev -- Input data, numpy array of shape (m, n_H_prev, n_W_prev, n_C_prev)
+    hparameters -- python dictionary containing "f" and "stride"
+    mode -- the pooling mode you would like to use, defined as a string ("max" or "average")
+    algorithm -- one of POOL_FORWARD_ALGORITHMS: "strided" (default) or "loop" (slow reference implementation)
+    cache_argmax -- only for mode "max", if True the position of every max is computed once here and stored
+                    in the cache, so pool_backward() does not have to search the windows again
+    workspace -- optional Workspace, A is then written in one of its buffers and is only valid until the
+                 next call with the same workspace
+    n_jobs -- number of threads, the batch is split in n_jobs shards computed in parallel (-1 uses every core)
+
+    Returns:
+    A -- output of the pool layer, a numpy array of shape (m, n_H, n_W, n_C)
+    cache -- cache used in the backward pass of the pooling layer, contains the input and hparameters
+             (and the argmax indices when cache_argmax is True)
+    """
+
+    if mode not in ("max", "average"):
+        raise ValueError("Unknown pooling mode: " + str(mode))
+    if algorithm not in POOL_FORWARD_ALGORITHMS:
+        raise ValueError("Unknown pooling algorithm: " + str(algorithm))
+
+    # Retrieve dimensions from the input shape
+    (m, n_H_prev, n_W_prev, n_C_prev) = A_prev.shape
+
+    # Retrieve hyperparameters from "hparameters"
+    f = hparameters["f"]
+    stride = hparameters["stride"]
+
+    # Define the dimensions of the output
+    n_H = int(1 + (n_H_prev - f) / stride)
+    n_W = int(1 + (n_W_prev - f) / stride)
+    n_C = n_C_prev
+
+    slices = batch_slices(m, n_jobs)
+    if len(slices) > 1:
+        def forward_shard(index, batch_slice):
+            return pool_forward(A_prev[batch_slice], hparameters, mode, algorithm, cache_argmax, shard_workspace(workspace, index))
+        results = map_shards(forward_shard, slices)
+        A = workspace_empty(workspace, "shards/A", (m, n_H, n_W, n_C), results[0][0].dtype)
+        np.concatenate([A_shard for (A_shard, cache_shard) in results], axis=0, out=A)
+        if mode == "max" and cache_argmax:
+            # The argmax of a shard indexes its own part of the batch, shift it to index the whole A_prev
+            example_size = n_H_prev*n_W_prev*n_C_prev
+            argmax = np.concatenate([cache_shard[2] + batch_slice.start*example_size
+                                     for ((A_shard, cache_shard), batch_slice) in zip(results, slices)], axis=0)
+            cache = (A_prev, hparameters, argmax)
+        else:
+            cache = (A_prev, hparameters)
+    elif mode == "max" and cache_argmax:
+        # The max values are read back from the argmax, the windows are searched only once
+        argmax = pool_argmax(A_prev, f, stride, n_H, n_W)
+        A = workspace_empty(workspace, "argmax/A", (m, n_H, n_W, n_C), compute_dtype(A_prev))
+        if A.dtype == A_prev.dtype:
+            np.take(A_prev, argmax, out=A)
+        else:
+            # integer inputs (uint8 images) are gathered first and cast into the float buffer
+            A[...] = np.take(A_prev, argmax)
+        cache = (A_prev, hparameters, argmax)
+    else:
+        A = POOL_FORWARD_ALGORITHMS[algorithm](A_prev, f, stride, n_H, n_W, mode, workspace)
+        # Store the input and hparameters in "cache" for pool_backward()
+        cache = (A_prev, hparameters)
 
     # Making sure your output shape is correct
     assert(A.shape == (m, n_H, n_W, n_C))
@@ -155,53 +1396,84 @@ def pool_forward(A_prev, hparameters, mode = "max"):
     return A, cache
 
 
-def conv_backward(dZ, cache):
+def col2im(dcols, padded_shape, f, stride, out=None, dilation=1, groups=1):
     """
-    Implement the backward propagation for a convolution function
+    Inverse of im2col, folds the rows of a column matrix back into the padded activations.
+    Overlapping patches (stride < f) are summed, it is the scatter-add needed by the backward pass.
 
     Arguments:
-    dZ -- gradient of the cost with respect to the output of the conv layer (Z), numpy array of shape (m, n_H, n_W, n_C)
-    cache -- cache of values needed for the conv_backward(), output of conv_forward()
+    dcols -- numpy array of shape (m*n_H*n_W, f*f*n_C_prev), one unrolled patch per row,
+             or (groups, m*n_H*n_W, f*f*n_C_prev/groups) with groups > 1
+    padded_shape -- shape (m, n_H_prev + 2*pad, n_W_prev + 2*pad, n_C_prev) of the padded activations
+    f -- integer, size of the filters
+    stride -- integer, stride of the convolution
+    out -- optional array of shape padded_shape to accumulate into, it is zeroed first
+    dilation -- integer, dilation of the filters
+    groups -- integer, number of groups of channels
 
     Returns:
-    dA_prev -- gradient of the cost with respect to the input of the conv layer (A_prev),
-               numpy array of shape (m, n_H_prev, n_W_prev, n_C_prev)
-    dW -- gradient of the cost with respect to the weights of the conv layer (W)
-          numpy array of shape (f, f, n_C_prev, n_C)
-    db -- gradient of the cost with respect to the biases of the conv layer (b)
-          numpy array of shape (1, 1, 1, n_C)
+    dA_prev_pad -- numpy array of shape padded_shape
     """
 
-    ### START CODE HERE ###
-    # Retrieve information from "cache"
-    (A_prev, W, b, hparameters) = cache
+    (m, n_H_prev_pad, n_W_prev_pad, n_C_prev) = padded_shape
+    f_dilated = (f - 1)*dilation + 1
+    n_H = int((n_H_prev_pad - f_dilated)/stride)+1
+    n_W = int((n_W_prev_pad - f_dilated)/stride)+1
 
-    # Retrieve dimensions from A_prev's shape
-    (m, n_H_prev, n_W_prev, n_C_prev) = A_prev.shape
+    if out is None:
+        dA_prev_pad = np.zeros(padded_shape, dtype=dcols.dtype)
+    else:
+        dA_prev_pad = out
+        dA_prev_pad.fill(0)
 
-    # Retrieve dimensions from W's shape
-    (f, f, n_C_prev, n_C) = W.shape
+    # (m, n_H, n_W, f, f, groups, n_C_prev/groups), the channels of dA_prev_pad are split the same way
+    dcols = dcols.reshape(groups, m, n_H, n_W, f, f, n_C_prev//groups).transpose(1, 2, 3, 4, 5, 0, 6)
+    dA_groups = dA_prev_pad.reshape(m, n_H_prev_pad, n_W_prev_pad, groups, n_C_prev//groups)
 
-    # Retrieve information from "hparameters"
-    stride = hparameters['stride']
-    pad = hparameters['pad']
+    # Only f*f iterations: every offset (u, v) of the filter adds one (m, n_H, n_W, n_C_prev) block
+    # to the strided positions it touched in the forward pass
+    for u in range(f):
+        for v in range(f):
+            vert_start = u*dilation
+            horiz_start = v*dilation
+            dA_groups[:, vert_start:vert_start + stride*n_H:stride, horiz_start:horiz_start + stride*n_W:stride] += dcols[:, :, :, u, v]
+
+    return dA_prev_pad
+
+
+def conv_backward_loop(dZ, A_prev_pad, W, stride, workspace=None, dilation=1, groups=1):
+    """
+    Reference backward pass, updates the gradients one window and one channel at a time.
+    It is very slow, keep it to check the results of the vectorized algorithms.
+
+    Arguments:
+    dZ -- gradient of the cost with respect to Z, numpy array of shape (m, n_H, n_W, n_C)
+    A_prev_pad -- padded activations, numpy array of shape (m, n_H_prev + 2*pad, n_W_prev + 2*pad, n_C_prev)
+    W -- Weights, numpy array of shape (f, f, n_C_prev/groups, n_C)
+    stride -- integer, stride of the convolution
+    workspace -- optional Workspace to borrow the gradients and temporary buffers from
+    dilation -- integer, dilation of the filters
+    groups -- integer, number of groups of channels
+
+    Returns:
+    dA_prev_pad -- gradient of the cost with respect to A_prev_pad, same shape as A_prev_pad
+    dW -- gradient of the cost with respect to W, numpy array of shape (f, f, n_C_prev/groups, n_C)
+    db -- gradient of the cost with respect to b, numpy array of shape (1, 1, 1, n_C)
+    """
 
-    # Retrieve dimensions from dZ's shape
+    (f, f, n_C_group, n_C) = W.shape
     (m, n_H, n_W, n_C) = dZ.shape
-    # Initialize dA_prev, dW, db with the correct shapes
-    dA_prev = np.zeros((m, n_H_prev, n_W_prev, n_C_prev))
-    dW = np.zeros((f, f, n_C_prev, n_C))
-    db = np.zeros((1, 1, 1, n_C))
+    f_dilated = (f - 1)*dilation + 1
 
-    # Pad A_prev and dA_prev
-    A_prev_pad = zero_pad(A_prev, pad)
-    dA_prev_pad = zero_pad(dA_prev, pad)
+    dtype = compute_dtype(dZ, A_prev_pad, W)
+    dA_prev_pad = workspace_zeros(workspace, "loop/dA_prev_pad", A_prev_pad.shape, dtype)
+    dW = workspace_zeros(workspace, "loop/dW", (f, f, n_C_group, n_C), dtype)
+    db = workspace_zeros(workspace, "loop/db", (1, 1, 1, n_C), dtype)
 
     for i in range(m):          # loop over the training examples
 
         # select ith training example from A_prev_pad and dA_prev_pad
         a_prev_pad = A_prev_pad[i, :, :, :]
-        da_prev_pad = dA_prev_pad[i, :, :, :]
 
         for h in range(n_H):                   # loop over vertical axis of the output volume
             for w in range(n_W):               # loop over horizontal axis of the output volume
@@ -209,20 +1481,344 @@ def conv_backward(dZ, cache):
 
                     # Find the corners of the current "slice"
                     vert_start = h*stride
-                    vert_end = f+vert_start
+                    vert_end = f_dilated+vert_start
                     horiz_start = w*stride
-                    horiz_end = f+horiz_start
+                    horiz_end = f_dilated+horiz_start
+                    # Input channels of the group of the filter c
+                    channel_start = (c//(n_C//groups))*n_C_group
+                    channel_end = channel_start + n_C_group
 
                     # Use the corners to define the slice from a_prev_pad
-                    a_slice = a_prev_pad[vert_start:vert_end, horiz_start:horiz_end, :]
+                    a_slice = a_prev_pad[vert_start:vert_end:dilation, horiz_start:horiz_end:dilation, channel_start:channel_end]
                     # Update gradients for the window and the filter's parameters using the code formulas given above
-                    dA_prev_pad[i,vert_start:vert_end, horiz_start:horiz_end, :] += W[:,:,:,c] * dZ[i, h, w, c]
+                    dA_prev_pad[i, vert_start:vert_end:dilation, horiz_start:horiz_end:dilation, channel_start:channel_end] += W[:,:,:,c] * dZ[i, h, w, c]
                     dW[:, :, :, c] += a_slice*dZ[i, h, w, c]
                     db[:, :, :, c] += dZ[i, h, w, c]
 
-        # Set the ith training example's dA_prev to the unpaded da_prev_pad (Hint: use X[pad:-pad, pad:-pad, :])
-        dA_prev[i, :, :, :] = da_prev_pad[pad:-pad, pad:-pad, :]
-    ### END CODE HERE ###
+    return dA_prev_pad, dW, db
+
+
+def conv_backward_col2im(dZ, A_prev_pad, W, stride, workspace=None, dilation=1, groups=1):
+    """
+    Vectorized backward pass. dW and db are a single matrix product and a single reduction over the
+    unrolled patches, dA_prev_pad is folded back from the patch gradients with col2im.
+    With groups > 1 there is one matrix product per group.
+
+    Arguments:
+    dZ -- gradient of the cost with respect to Z, numpy array of shape (m, n_H, n_W, n_C)
+    A_prev_pad -- padded activations, numpy array of shape (m, n_H_prev + 2*pad, n_W_prev + 2*pad, n_C_prev)
+    W -- Weights, numpy array of shape (f, f, n_C_prev/groups, n_C)
+    stride -- integer, stride of the convolution
+    workspace -- optional Workspace to borrow the gradients and temporary buffers from
+    dilation -- integer, dilation of the filters
+    groups -- integer, number of groups of channels
+
+    Returns:
+    dA_prev_pad -- gradient of the cost with respect to A_prev_pad, same shape as A_prev_pad
+    dW -- gradient of the cost with respect to W, numpy array of shape (f, f, n_C_prev/groups, n_C)
+    db -- gradient of the cost with respect to b, numpy array of shape (1, 1, 1, n_C)
+    """
+
+    (f, f, n_C_group, n_C) = W.shape
+    (m, n_H, n_W, n_C) = dZ.shape
+    rows = m*n_H*n_W
+    K = f*f*n_C_group
+    dtype = compute_dtype(dZ, A_prev_pad, W)
+
+    cols_shape = (rows, K) if groups == 1 else (groups, rows, K)
+    cols = im2col(A_prev_pad, f, stride, workspace_empty(workspace, "col2im/cols", cols_shape, dtype), dilation, groups)
+    cols = cols.reshape(groups, rows, K)
+    dZ_flat = dZ.reshape(rows, n_C).astype(dtype, copy=False)
+    W_flat = W.reshape(K, n_C).astype(dtype, copy=False)
+
+    # (f*f*n_C_prev, m*n_H*n_W) x (m*n_H*n_W, n_C)
+    dW = workspace_empty(workspace, "col2im/dW", (f, f, n_C_group, n_C), dtype)
+    grouped_dot(cols.transpose(0, 2, 1), group_matrix(dZ_flat, groups), dW.reshape(K, n_C), workspace, "col2im/dW_groups")
+    db = workspace_empty(workspace, "col2im/db", (1, 1, 1, n_C), dtype)
+    np.sum(dZ_flat, axis=0, out=db.reshape(n_C))
+
+    # Gradient of every unrolled patch, (m*n_H*n_W, n_C) x (n_C, f*f*n_C_prev), in the layout of cols
+    dcols = workspace_empty(workspace, "col2im/dcols", cols_shape, dtype)
+    np.matmul(group_matrix(dZ_flat, groups), group_matrix(W_flat, groups).transpose(0, 2, 1), out=dcols.reshape(groups, rows, K))
+    dA_prev_pad = col2im(dcols, A_prev_pad.shape, f, stride, workspace_empty(workspace, "col2im/dA_prev_pad", A_prev_pad.shape, dtype),
+                         dilation, groups)
+
+    return dA_prev_pad, dW, db
+
+
+def conv_backward_1x1(dZ, A_prev_pad, W, stride, workspace=None, dilation=1, groups=1):
+    """
+    Backward pass of a convolution with 1x1 filters, three matrix products over the channels and no patches.
+
+    Arguments:
+    dZ -- gradient of the cost with respect to Z, numpy array of shape (m, n_H, n_W, n_C)
+    A_prev_pad -- padded activations, numpy array of shape (m, n_H_prev + 2*pad, n_W_prev + 2*pad, n_C_prev)
+    W -- Weights, numpy array of shape (1, 1, n_C_prev/groups, n_C)
+    stride -- integer, stride of the convolution
+    workspace -- optional Workspace to borrow the gradients and temporary buffers from
+    dilation -- integer, has no effect on a 1x1 filter
+    groups -- integer, number of groups of channels
+
+    Returns:
+    dA_prev_pad -- gradient of the cost with respect to A_prev_pad, same shape as A_prev_pad
+    dW -- gradient of the cost with respect to W, numpy array of shape (1, 1, n_C_prev/groups, n_C)
+    db -- gradient of the cost with respect to b, numpy array of shape (1, 1, 1, n_C)
+    """
+
+    (f, f, n_C_group, n_C) = W.shape
+    if f != 1:
+        raise ValueError("1x1 only supports 1x1 filters")
+
+    (m, n_H, n_W, n_C) = dZ.shape
+    (m, n_H_pad, n_W_pad, n_C_prev) = A_prev_pad.shape
+    rows = m*n_H*n_W
+    dtype = compute_dtype(dZ, A_prev_pad, W)
+
+    # Pixels seen by the forward pass
+    pixel_slice = (slice(None), slice(0, (n_H - 1)*stride + 1, stride), slice(0, (n_W - 1)*stride + 1, stride))
+    pixels = A_prev_pad[pixel_slice]
+    if pixels.flags.c_contiguous and pixels.dtype == dtype:
+        cols = pixels.reshape(rows, n_C_prev)
+    else:
+        cols = workspace_empty(workspace, "1x1/cols", (rows, n_C_prev), dtype)
+        np.copyto(cols.reshape(m, n_H, n_W, n_C_prev), pixels)
+    dZ_flat = dZ.reshape(rows, n_C).astype(dtype, copy=False)
+    W_flat = W.reshape(n_C_group, n_C).astype(dtype, copy=False)
+
+    dW = workspace_empty(workspace, "1x1/dW", (1, 1, n_C_group, n_C), dtype)
+    grouped_dot(group_matrix(cols, groups).transpose(0, 2, 1), group_matrix(dZ_flat, groups), dW.reshape(n_C_group, n_C),
+                workspace, "1x1/dW_groups")
+    db = workspace_empty(workspace, "1x1/db", (1, 1, 1, n_C), dtype)
+    np.sum(dZ_flat, axis=0, out=db.reshape(n_C))
+
+    # (m*n_H*n_W, n_C) x (n_C, n_C_prev), the skipped pixels of a strided convolution get no gradient
+    dA_prev_pad = workspace_empty(workspace, "1x1/dA_prev_pad", A_prev_pad.shape, dtype)
+    every_pixel = (n_H, n_W) == (n_H_pad, n_W_pad)
+    if every_pixel:
+        dA_pixels = dA_prev_pad.reshape(rows, n_C_prev)
+    else:
+        dA_prev_pad.fill(0)
+        dA_pixels = workspace_empty(workspace, "1x1/dA_pixels", (rows, n_C_prev), dtype)
+    grouped_dot(group_matrix(dZ_flat, groups), group_matrix(W_flat, groups).transpose(0, 2, 1), dA_pixels,
+                workspace, "1x1/dA_groups")
+    if not every_pixel:
+        dA_prev_pad[pixel_slice] = dA_pixels.reshape(m, n_H, n_W, n_C_prev)
+
+    return dA_prev_pad, dW, db
+
+
+def conv_backward_sparse(dZ, A_prev_pad, W, stride, workspace=None, dilation=1, groups=1):
+    """
+    Backward pass that only visits the output pixels where dZ is not zero (after a ReLU, or on the black
+    background of the images, many of them are). Only their patches are gathered, the matrix products
+    have one row per nonzero pixel and their patch gradients are added back at their own positions.
+
+    Arguments:
+    dZ -- gradient of the cost with respect to Z, numpy array of shape (m, n_H, n_W, n_C)
+    A_prev_pad -- padded activations, numpy array of shape (m, n_H_prev + 2*pad, n_W_prev + 2*pad, n_C_prev)
+    W -- Weights, numpy array of shape (f, f, n_C_prev/groups, n_C)
+    stride -- integer, stride of the convolution
+    workspace -- optional Workspace to borrow the gradients from
+    dilation -- integer, dilation of the filters
+    groups -- integer, number of groups of channels
+
+    Returns:
+    dA_prev_pad -- gradient of the cost with respect to A_prev_pad, same shape as A_prev_pad
+    dW -- gradient of the cost with respect to W, numpy array of shape (f, f, n_C_prev/groups, n_C)
+    db -- gradient of the cost with respect to b, numpy array of shape (1, 1, 1, n_C)
+    """
+
+    (f, f, n_C_group, n_C) = W.shape
+    (m, n_H, n_W, n_C) = dZ.shape
+    n_C_prev = A_prev_pad.shape[3]
+    K = f*f*n_C_group
+    dtype = compute_dtype(dZ, A_prev_pad, W)
+
+    dZ_flat = dZ.reshape(m*n_H*n_W, n_C)
+    db = workspace_empty(workspace, "sparse/db", (1, 1, 1, n_C), dtype)
+    np.sum(dZ_flat, axis=0, out=db.reshape(n_C))
+
+    # Output pixels with at least one nonzero channel
+    active = np.flatnonzero(dZ_flat.any(axis=1))
+    (i, h, w) = np.unravel_index(active, (m, n_H, n_W))
+    k = len(active)
+    dZ_active = dZ_flat[active].astype(dtype, copy=False)
+
+    # (k, f, f, n_C_prev) patches of the active pixels only
+    patches = get_windows(A_prev_pad, f, stride, dilation)[i, h, w].astype(dtype, copy=False)
+    if groups > 1:
+        patches = patches.reshape(k, f, f, groups, n_C_group).transpose(3, 0, 1, 2, 4)
+    cols = np.ascontiguousarray(patches).reshape(groups, k, K)
+    W_flat = W.reshape(K, n_C).astype(dtype, copy=False)
+
+    dW = workspace_empty(workspace, "sparse/dW", (f, f, n_C_group, n_C), dtype)
+    grouped_dot(cols.transpose(0, 2, 1), group_matrix(dZ_active, groups), dW.reshape(K, n_C), workspace, "sparse/dW_groups")
+
+    # (groups, k, K) -> (k, f, f, n_C_prev)
+    dcols = np.matmul(group_matrix(dZ_active, groups), group_matrix(W_flat, groups).transpose(0, 2, 1))
+    dcols = dcols.reshape(groups, k, f, f, n_C_group).transpose(1, 2, 3, 0, 4).reshape(k, f, f, n_C_prev)
+
+    dA_prev_pad = workspace_zeros(workspace, "sparse/dA_prev_pad", A_prev_pad.shape, dtype)
+    # For one offset (u, v) of the filter two pixels never touch the same input position, so a
+    # fancy-indexed += (which does not accumulate repeated indices) is exact
+    for u in range(f):
+        for v in range(f):
+            dA_prev_pad[i, h*stride + u*dilation, w*stride + v*dilation] += dcols[:, u, v]
+
+    return dA_prev_pad, dW, db
+
+
+# conv_backward() switches from col2im to sparse below a fraction of nonzero output pixels that grows with the
+# work of the layer per output pixel, f*f*n_C_prev/groups*n_C: the dense products of a small layer are cheap, the
+# gather and scatter of the sparse pass are not. Pairs (minimum work per pixel, threshold), the first one the
+# layer reaches is used. Every threshold is the lowest crossover "python benchmark.py --kernels sparse" measured
+# for the shapes of its range (over two float32 runs):
+#   work < 512:          fashion_conv1 (72) crosses at 0.2
+#   512 <= work < 4096:  fashion_conv2 (512) at 0.3, depthwise_3x3 (576) at 0.5, keras_conv5x5 (900) at 0.5-0.7
+#   work >= 4096:        resnet_conv1 (9408) at 0.5, grouped_3x3 and the ResNet 3x3 stages at 0.7,
+#                        dilated_3x3 at 0.7-1.0
+# An empty tuple disables the switch.
+SPARSE_DENSITY_THRESHOLDS = ((4096, 0.5), (512, 0.3), (0, 0.2))
+
+
+def sparse_density_threshold(W_shape):
+    """
+    Fraction of nonzero output pixels of dZ below which conv_backward() uses conv_backward_sparse(), for a layer
+    with filters of shape W_shape (f, f, n_C_prev/groups, n_C). See SPARSE_DENSITY_THRESHOLDS.
+    """
+
+    (f, f, n_C_group, n_C) = W_shape
+    work = f*f*n_C_group*n_C
+    for (min_work, threshold) in SPARSE_DENSITY_THRESHOLDS:
+        if work >= min_work:
+            return threshold
+
+    return 0.
+
+
+def dz_density(dZ):
+    """
+    Fraction of the output pixels of dZ with at least one nonzero channel, the work left to conv_backward_sparse().
+    """
+
+    dZ_flat = dZ.reshape(-1, dZ.shape[-1])
+    if dZ_flat.shape[0] == 0:
+        return 1.
+
+    return np.count_nonzero(dZ_flat.any(axis=1))/float(dZ_flat.shape[0])
+
+
+CONV_BACKWARD_ALGORITHMS = {"col2im": conv_backward_col2im,
+                            "1x1": conv_backward_1x1,
+                            "sparse": conv_backward_sparse,
+                            "loop": conv_backward_loop}
+
+
+@profile_kernel(conv_backward_flops)
+def conv_backward(dZ, cache, algorithm="col2im", workspace=None, n_jobs=1, memory_budget=None):
+    """
+    Implement the backward propagation for a convolution function
+
+    Arguments:
+    dZ -- gradient of the cost with respect to the output of the conv layer (Z), numpy array of shape (m, n_H, n_W, n_C)
+    cache -- cache of values needed for the conv_backward(), output of conv_forward()
+    algorithm -- one of CONV_BACKWARD_ALGORITHMS: "col2im" (default), "1x1" (1x1 filters), "sparse" (only the
+                 output pixels where dZ is not zero) or "loop" (slow reference implementation).
+                 "col2im" runs 1x1 filters with "1x1", and uses "sparse" when the fraction of nonzero pixels
+                 of dZ is below sparse_density_threshold() of the layer.
+                 "auto" lets default_autotuner pick the fastest of "col2im" and "sparse" for this shape and
+                 density of dZ, after the same sparse switch.
+    workspace -- optional Workspace, the gradients are then written in its buffers instead of new arrays
+                 and are only valid until the next call with the same workspace
+    n_jobs -- number of threads, the batch is split in n_jobs shards computed in parallel (-1 uses every core).
+              Every worker accumulates its own dW and db, they are summed at the end.
+    memory_budget -- optional number of bytes, the gradients are then accumulated tile by tile like in
+                     conv_forward(). They only differ from the untiled ones by the float rounding of the sums.
+
+    Returns:
+    dA_prev -- gradient of the cost with respect to the input of the conv layer (A_prev),
+               numpy array of shape (m, n_H_prev, n_W_prev, n_C_prev)
+    dW -- gradient of the cost with respect to the weights of the conv layer (W)
+          numpy array of shape (f, f, n_C_prev/groups, n_C)
+    db -- gradient of the cost with respect to the biases of the conv layer (b)
+          numpy array of shape (1, 1, 1, n_C)
+    """
+
+    if algorithm != "auto" and algorithm not in CONV_BACKWARD_ALGORITHMS:
+        raise ValueError("Unknown convolution algorithm: " + str(algorithm))
+
+    # Retrieve information from "cache"
+    (A_prev, W, b, hparameters) = cache
+
+    # Retrieve dimensions from A_prev's shape
+    (m, n_H_prev, n_W_prev, n_C_prev) = A_prev.shape
+
+    # Retrieve information from "hparameters"
+    stride = hparameters['stride']
+    pad = hparameters['pad']
+    dilation = hparameters.get('dilation', 1)
+    groups = hparameters.get('groups', 1)
+
+    f = W.shape[0]
+    if f == 1 and algorithm == "col2im":
+        algorithm = "1x1"
+
+    def compute(dZ, A_prev_pad, key_shape, key_pad):
+        # The sparsity of dZ changes with every batch, it is checked on every call (and every tile)
+        density = None
+        if algorithm in ("col2im", "auto") and f > 1:
+            density = dz_density(dZ)
+            if density < sparse_density_threshold(W.shape):
+                return conv_backward_sparse(dZ, A_prev_pad, W, stride, workspace, dilation, groups)
+        if algorithm == "auto":
+            key = default_autotuner.key("backward", key_shape, W.shape, stride, key_pad, A_prev.dtype, dilation, groups,
+                                        density)
+            return default_autotuner.run(key, conv_backward_candidates(f, stride, dilation, groups), CONV_BACKWARD_ALGORITHMS,
+                                         dZ, A_prev_pad, W, stride, workspace, dilation, groups)
+        return CONV_BACKWARD_ALGORITHMS[algorithm](dZ, A_prev_pad, W, stride, workspace, dilation, groups)
+
+    slices = batch_slices(m, n_jobs)
+    if len(slices) > 1:
+        shard_budget = memory_budget//len(slices) if memory_budget is not None else None
+        def backward_shard(index, batch_slice):
+            cache_shard = (A_prev[batch_slice], W, b, hparameters)
+            return conv_backward(dZ[batch_slice], cache_shard, algorithm, shard_workspace(workspace, index),
+                                 memory_budget=shard_budget)
+        results = map_shards(backward_shard, slices)
+        dtype = results[0][0].dtype
+        dA_prev = workspace_empty(workspace, "shards/dA_prev", A_prev.shape, dtype)
+        np.concatenate([dA_shard for (dA_shard, dW_shard, db_shard) in results], axis=0, out=dA_prev)
+        # Reduce the per-worker accumulators
+        dW = workspace_zeros(workspace, "shards/dW", W.shape, dtype)
+        db = workspace_zeros(workspace, "shards/db", (1, 1, 1, W.shape[3]), dtype)
+        for (dA_shard, dW_shard, db_shard) in results:
+            dW += dW_shard
+            db += db_shard
+        return dA_prev, dW, db
+
+    # Pad A_prev
+    A_prev_pad = workspace_pad(workspace, A_prev, pad, "A_prev_pad")
+
+    if memory_budget is not None:
+        (m, n_H, n_W, n_C) = dZ.shape
+        dtype = compute_dtype(dZ, A_prev, W)
+        dA_prev_pad = workspace_zeros(workspace, "tiled/dA_prev_pad", A_prev_pad.shape, dtype)
+        dW = workspace_zeros(workspace, "tiled/dW", W.shape, dtype)
+        db = workspace_zeros(workspace, "tiled/db", (1, 1, 1, n_C), dtype)
+        pixel_bytes = conv_pixel_bytes(W, n_C_prev, dtype, "backward")
+        for tile in conv_tiles(m, n_H, n_W, pixel_bytes, memory_budget):
+            # Bands of rows overlap in the input, their gradients are summed
+            tile_input = conv_tile_input(A_prev_pad, tile, stride, (f - 1)*dilation + 1)
+            A_tile = A_prev_pad[tile_input]
+            dA_tile, dW_tile, db_tile = compute(dZ[tile], A_tile, A_tile.shape, 0)
+            dA_prev_pad[tile_input] += dA_tile
+            dW += dW_tile
+            db += db_tile
+    else:
+        dA_prev_pad, dW, db = compute(dZ, A_prev_pad, A_prev.shape, pad)
+
+    # Remove the padding. X[pad:-pad] would be empty when pad == 0, so slice with the explicit end.
+    dA_prev = dA_prev_pad[:, pad:pad + n_H_prev, pad:pad + n_W_prev, :]
 
     # Making sure your output shape is correct
     assert(dA_prev.shape == (m, n_H_prev, n_W_prev, n_C_prev))
@@ -273,34 +1869,28 @@ def distribute_value(dz, shape):
     return a
 
 
-def pool_backward(dA, cache, mode = "max"):
+def pool_backward_loop(dA, A_prev, f, stride, mode):
     """
-    Implements the backward pass of the pooling layer
+    Reference backward pass of the pooling layer, one window and one channel at a time.
+    It is very slow, keep it to check the results of the vectorized algorithms.
 
     Arguments:
     dA -- gradient of cost with respect to the output of the pooling layer, same shape as A
-    cache -- cache output from the forward pass of the pooling layer, contains the layer's input and hparameters
+    A_prev -- Input data of the pooling layer, numpy array of shape (m, n_H_prev, n_W_prev, n_C_prev)
+    f -- integer, size of the pooling window
+    stride -- integer, stride of the pooling window
     mode -- the pooling mode you would like to use, defined as a string ("max" or "average")
 
     Returns:
     dA_prev -- gradient of cost with respect to the input of the pooling layer, same shape as A_prev
     """
 
-    ### START CODE HERE ###
-
-    # Retrieve information from cache (≈1 line)
-    (A_prev, hparameters) = cache
-
-    # Retrieve hyperparameters from "hparameters" (≈2 lines)
-    stride = hparameters['stride']
-    f = hparameters['f']
-
     # Retrieve dimensions from A_prev's shape and dA's shape (≈2 lines)
     m, n_H_prev, n_W_prev, n_C_prev = A_prev.shape
     m, n_H, n_W, n_C = dA.shape
 
     # Initialize dA_prev with zeros (≈1 line)
-    dA_prev = np.zeros((m, n_H_prev, n_W_prev, n_C_prev))
+    dA_prev = np.zeros((m, n_H_prev, n_W_prev, n_C_prev), dtype=compute_dtype(dA, A_prev))
 
     for i in range(m):                       # loop over the training examples
 
@@ -336,7 +1926,130 @@ def pool_backward(dA, cache, mode = "max"):
                         # Distribute it to get the correct slice of dA_prev. i.e. Add the distributed value of da. (≈1 line)
                         dA_prev[i, vert_start: vert_end, horiz_start: horiz_end, c] += distribute_value(da, shape)
 
-    ### END CODE ###
+    return dA_prev
+
+
+def pool_backward_max(dA, A_prev, f, stride, argmax=None, workspace=None):
+    """
+    Vectorized backward pass of a max pooling layer, every gradient is scattered to the max of its window.
+
+    Arguments:
+    dA -- gradient of cost with respect to the output of the pooling layer, shape (m, n_H, n_W, n_C)
+    A_prev -- Input data of the pooling layer, numpy array of shape (m, n_H_prev, n_W_prev, n_C_prev)
+    f -- integer, size of the pooling window
+    stride -- integer, stride of the pooling window
+    argmax -- flat indices of the max entries, output of pool_argmax(). Computed here when it is None
+    workspace -- optional Workspace to borrow the output buffer from
+
+    Returns:
+    dA_prev -- gradient of cost with respect to the input of the pooling layer, same shape as A_prev
+    """
+
+    (m, n_H, n_W, n_C) = dA.shape
+
+    dtype = compute_dtype(dA, A_prev)
+
+    if argmax is None:
+        argmax = pool_argmax(A_prev, f, stride, n_H, n_W)
+
+    if stride >= f:
+        # The windows do not overlap so every index is unique, a plain assignment is enough
+        dA_prev = workspace_zeros(workspace, "max/dA_prev", A_prev.shape, dtype)
+        dA_prev.ravel()[argmax.ravel()] = dA.ravel()
+    else:
+        # Overlapping windows can share their max, bincount sums the repeated indices (in float64)
+        dA_prev = np.bincount(argmax.ravel(), weights=dA.ravel(), minlength=A_prev.size)
+        dA_prev = dA_prev.astype(dtype, copy=False).reshape(A_prev.shape)
+
+    return dA_prev
+
+
+def pool_backward_average(dA, A_prev, f, stride, workspace=None):
+    """
+    Vectorized backward pass of an average pooling layer, every gradient is spread evenly over its window.
+
+    Arguments:
+    dA -- gradient of cost with respect to the output of the pooling layer, shape (m, n_H, n_W, n_C)
+    A_prev -- Input data of the pooling layer, numpy array of shape (m, n_H_prev, n_W_prev, n_C_prev)
+    f -- integer, size of the pooling window
+    stride -- integer, stride of the pooling window
+    workspace -- optional Workspace to borrow the output buffer from
+
+    Returns:
+    dA_prev -- gradient of cost with respect to the input of the pooling layer, same shape as A_prev
+    """
+
+    (m, n_H, n_W, n_C) = dA.shape
+
+    dtype = compute_dtype(dA, A_prev)
+    dA_prev = workspace_zeros(workspace, "average/dA_prev", A_prev.shape, dtype)
+    da = (dA/(f*f)).astype(dtype, copy=False)
+
+    if f == stride:
+        # Upsample by broadcasting every value over its (f, f) block
+        blocks = dA_prev[:, :n_H*f, :n_W*f, :].reshape(m, n_H, f, n_W, f, n_C)
+        blocks[...] = da[:, :, np.newaxis, :, np.newaxis, :]
+    else:
+        # One strided add per position (u, v) inside the window
+        for u in range(f):
+            for v in range(f):
+                dA_prev[:, u:u + stride*n_H:stride, v:v + stride*n_W:stride, :] += da
+
+    return dA_prev
+
+
+@profile_kernel(pool_backward_flops)
+def pool_backward(dA, cache, mode = "max", algorithm="scatter", workspace=None, n_jobs=1):
+    """
+    Implements the backward pass of the pooling layer
+
+    Arguments:
+    dA -- gradient of cost with respect to the output of the pooling layer, same shape as A
+    cache -- cache output from the forward pass of the pooling layer, contains the layer's input and hparameters
+    mode -- the pooling mode you would like to use, defined as a string ("max" or "average")
+    algorithm -- "scatter" (default, vectorized) or "loop" (slow reference implementation).
+                 In mode "max" the vectorized version gives the whole gradient to the first max of a window,
+                 the reference version gives it to every entry equal to the max.
+    workspace -- optional Workspace, dA_prev is then written in one of its buffers and is only valid until the
+                 next call with the same workspace
+    n_jobs -- number of threads, the batch is split in n_jobs shards computed in parallel (-1 uses every core)
+
+    Returns:
+    dA_prev -- gradient of cost with respect to the input of the pooling layer, same shape as A_prev
+    """
+
+    if mode not in ("max", "average"):
+        raise ValueError("Unknown pooling mode: " + str(mode))
+    if algorithm not in ("scatter", "loop"):
+        raise ValueError("Unknown pooling algorithm: " + str(algorithm))
+
+    # Retrieve information from cache, pool_forward() adds the argmax when it was asked to
+    A_prev = cache[0]
+    hparameters = cache[1]
+    argmax = cache[2] if len(cache) > 2 else None
+
+    # Retrieve hyperparameters from "hparameters" (≈2 lines)
+    stride = hparameters['stride']
+    f = hparameters['f']
+
+    slices = batch_slices(A_prev.shape[0], n_jobs)
+    if len(slices) > 1:
+        example_size = A_prev[0].size
+        def backward_shard(index, batch_slice):
+            cache_shard = (A_prev[batch_slice], hparameters)
+            if argmax is not None:
+                # Back to indices inside the shard
+                cache_shard += (argmax[batch_slice] - batch_slice.start*example_size,)
+            return pool_backward(dA[batch_slice], cache_shard, mode, algorithm, shard_workspace(workspace, index))
+        dA_shards = map_shards(backward_shard, slices)
+        dA_prev = workspace_empty(workspace, "shards/dA_prev", A_prev.shape, dA_shards[0].dtype)
+        np.concatenate(dA_shards, axis=0, out=dA_prev)
+    elif algorithm == "loop":
+        dA_prev = pool_backward_loop(dA, A_prev, f, stride, mode)
+    elif mode == "max":
+        dA_prev = pool_backward_max(dA, A_prev, f, stride, argmax, workspace)
+    elif mode == "average":
+        dA_prev = pool_backward_average(dA, A_prev, f, stride, workspace)
 
     # Making sure your output shape is correct
     assert(dA_prev.shape == A_prev.shape)
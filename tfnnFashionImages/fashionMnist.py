@@ -1,3 +1,4 @@
+import os
 import math
 import warnings
 warnings.filterwarnings("ignore", message="numpy.dtype size changed")
@@ -12,6 +13,11 @@ import argparse
 import sys
 import datetime
 import time
+import threading
+import queue
+# The dataset cache is shared with the convolutional models, it lives in convolutionalNetwork/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'convolutionalNetwork'))
+from fashion_dataset import load_dataset_cached, peak_rss, normalize_batch
 
 def random_mini_batches_tf(X, Y, mini_batch_size=32, thread_count=1, queue_capacity=100, seed=0):
     np.random.seed(seed)
@@ -24,13 +30,14 @@ def random_mini_batches_tf(X, Y, mini_batch_size=32, thread_count=1, queue_capac
     m = X.shape[1]
     permutation = list(np.random.permutation(m))
     shuffled_X = X[:, permutation]
-    shuffled_Y = Y[:, permutation].reshape((Y.shape[0],m))
+    shuffled_Y = Y[permutation]
 
+    # the constant stays uint8, the batches are normalized after being dequeued
     data_input_x = tf.constant(shuffled_X.T)
-    data_input_y = tf.constant(shuffled_Y.T)
+    data_input_y = tf.constant(shuffled_Y)
     batch_size = mini_batch_size
 
-    batch_x_y = tf.train.shuffle_batch((data_input_x, data_input_y),
+    batch_x, batch_y = tf.train.shuffle_batch((data_input_x, data_input_y),
                      enqueue_many=True,
                      batch_size=batch_size,
                      num_threads=thread_count,
@@ -38,104 +45,242 @@ def random_mini_batches_tf(X, Y, mini_batch_size=32, thread_count=1, queue_capac
                      min_after_dequeue = math.floor(queue_capacity/4),
                      allow_smaller_final_batch=True)
 
-    return batch_x_y
+    return tf.cast(batch_x, tf.float32) / 255., batch_y
+
+BATCH_METHODS = ('basic', 'experimental', 'tensorflow', 'prefetch', 'dataset')
+
+def dataset_mini_batches(n_x, mini_batch_size=32, num_epochs=1, thread_count=1, queue_capacity=100, seed=0):
+    """
+    tf.data pipeline of batch_method 'dataset'. The uint8 set is fed once to X_source and
+    Y_source when the iterator is initialized, then every epoch the examples are read from
+    the cache, shuffled, batched, normalized by a parallel map and prefetched while the
+    previous step runs, all inside the graph: no minibatch goes through feed_dict.
+
+    Arguments:
+    n_x -- number of pixels of an image
+    mini_batch_size -- size of the mini-batches, integer
+    num_epochs -- number of epochs the iterator yields
+    thread_count -- parallel calls of the normalization map
+    queue_capacity -- number of minibatches prefetched
+    seed -- seed of the shuffle
+
+    Returns:
+    X_source -- uint8 placeholder of the examples, of shape (m, n_x)
+    Y_source -- uint8 placeholder of the labels, of shape (m,)
+    iterator -- initializable iterator of (X, Y) minibatches, float32 (n_x, None) and int32 (None,)
+    """
+    print('THREADS COUNT:', thread_count)
+    print('PREFETCH:', queue_capacity)
+    print('BATCH SIZE:', mini_batch_size)
+    print('SEED:', seed)
+
+    X_source = tf.placeholder(tf.uint8, shape=[None, n_x], name='X_source')
+    Y_source = tf.placeholder(tf.uint8, shape=[None], name='Y_source')
+
+    def normalize(X_batch, Y_batch):
+        # in the (n_x, m) layout of the network
+        return tf.transpose(tf.cast(X_batch, tf.float32) / 255.), tf.cast(Y_batch, tf.int32)
+
+    dataset = tf.data.Dataset.from_tensor_slices((X_source, Y_source))
+    dataset = dataset.cache()
+    # a buffer of the whole set makes it a full shuffle, reshuffled every epoch
+    dataset = dataset.shuffle(buffer_size=tf.shape(X_source, out_type=tf.int64)[0], seed=seed, reshuffle_each_iteration=True)
+    # batch before repeat so an epoch ends with its own smaller last minibatch
+    dataset = dataset.batch(mini_batch_size)
+    dataset = dataset.repeat(num_epochs)
+    dataset = dataset.map(normalize, num_parallel_calls=thread_count)
+    dataset = dataset.prefetch(queue_capacity)
+
+    return X_source, Y_source, dataset.make_initializable_iterator()
+
+class MiniBatchPrefetcher(object):
+    """
+    Background producer of the minibatches of batch_method 'prefetch'.
+
+    thread_count producer threads shuffle, gather and normalize the minibatches of every
+    epoch ahead of the training step into a ring buffer of queue_capacity preallocated
+    slots, so the batch preparation overlaps with sess.run. The trainer gets them in order
+    (the same minibatches random_mini_batches_exp makes with the same seeds) and a slot
+    goes back to the producers when the trainer asks for the next minibatch.
+    wait_time is the time the trainer spent waiting on a minibatch that was not ready.
+    """
+
+    def __init__(self, X, Y, num_epochs, mini_batch_size=32, thread_count=1, queue_capacity=8, seed=0):
+        print('THREADS COUNT:', thread_count)
+        print('QUEUE CAPACITY:', queue_capacity)
+        print('BATCH SIZE:', mini_batch_size)
+        print('SEED:', seed)
+
+        self.X = X
+        self.Y = Y
+        (n_x, m) = X.shape
+        size = min(mini_batch_size, m)
+        self.mini_batch_size = mini_batch_size
+        self.num_minibatches = int(math.ceil(m / float(mini_batch_size)))
+        self.slots = [(np.empty((n_x, size), dtype=X.dtype),
+                       np.empty((n_x, size), dtype=np.float32),
+                       np.empty(size, dtype=Y.dtype)) for i in range(queue_capacity)]
+        self.free = queue.Queue()
+        for slot in range(queue_capacity):
+            self.free.put(slot)
+        self.ready = queue.Queue()
+        self.done = {}
+        self.next_minibatch = 0
+        self.wait_time = 0.
+
+        # the minibatches are claimed in order, each by a producer that already owns a slot,
+        # so the one the trainer waits for is always being produced
+        self.tasks = enumerate(self.indices(num_epochs, seed))
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.produce) for i in range(thread_count)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def indices(self, num_epochs, seed):
+        m = self.X.shape[1]
+        for epoch in range(num_epochs):
+            # seed + 1 for the first epoch, as the training loop of model
+            permutation = np.random.RandomState(seed + epoch + 1).permutation(m)
+            for k in range(0, m, self.mini_batch_size):
+                yield np.sort(permutation[k:k+self.mini_batch_size])
+
+    def produce(self):
+        try:
+            while True:
+                slot = self.free.get()
+                if slot is None:
+                    return
+                with self.lock:
+                    task = next(self.tasks, None)
+                if task is None:
+                    return
+                sequence, index = task
+                n = index.shape[0]
+                X_gather, X_batch, Y_batch = self.slots[slot]
+                np.take(self.X, index, axis=1, out=X_gather[:, :n], mode='clip')
+                np.take(self.Y, index, out=Y_batch[:n], mode='clip')
+                normalize_batch(X_gather[:, :n], out=X_batch[:, :n])
+                self.ready.put((sequence, slot, n, None))
+        except Exception as error:
+            self.ready.put((None, None, None, error))
+
+    def epoch(self):
+        """
+        Yields the (minibatch_X, minibatch_Y) of the next epoch. A minibatch lives in a slot
+        of the ring buffer, it is only valid until the next one is asked for.
+        """
+        for i in range(self.num_minibatches):
+            start = time.time()
+            while self.next_minibatch not in self.done:
+                sequence, slot, n, error = self.ready.get()
+                if error is not None:
+                    raise error
+                self.done[sequence] = (slot, n)
+            self.wait_time += time.time() - start
+
+            slot, n = self.done.pop(self.next_minibatch)
+            self.next_minibatch += 1
+            X_gather, X_batch, Y_batch = self.slots[slot]
+            yield (X_batch[:, :n], Y_batch[:n])
+            self.free.put(slot)
+
+    def close(self):
+        for thread in self.threads:
+            self.free.put(None)
+        for thread in self.threads:
+            thread.join()
 
 def random_mini_batches_exp(X, Y, mini_batch_size=32, seed=0):
+    """
+    Generates the minibatches of a random permutation of (X, Y). Only the permutation is
+    kept: every minibatch is gathered with np.take into the same preallocated uint8 buffer
+    and normalized into the same float32 buffer, so a yielded minibatch is overwritten by
+    the next one and has to be fed before the next is asked for.
+    """
     m = X.shape[1]                  # number of training examples
-    mini_batches = []
     np.random.seed(seed)
 
-    # Step 1: Shuffle (X, Y)
-    permutation = list(np.random.permutation(m))
-    shuffled_X = X[:, permutation]
-    shuffled_Y = Y[:, permutation].reshape((Y.shape[0],m))
-
-    for index in range(0, shuffled_X.shape[1], mini_batch_size):
-        mini_batch_X=shuffled_X[:,index:min(index+mini_batch_size,shuffled_X.shape[1])]
-        mini_batch_Y=shuffled_Y[:,index:min(index+mini_batch_size,shuffled_Y.shape[1])]
-        mini_batch = (mini_batch_X, mini_batch_Y)
-        mini_batches.append(mini_batch)
-
-    return mini_batches
+    # Step 1: Shuffle the indices of (X, Y)
+    permutation = np.random.permutation(m)
+
+    buffers = {}
+    for index in range(0, m, mini_batch_size):
+        batch = np.sort(permutation[index:min(index+mini_batch_size,m)])
+        n = batch.shape[0]
+        # one set of buffers per minibatch size: the full one and the smaller last one
+        if n not in buffers:
+            buffers[n] = (np.empty((X.shape[0], n), dtype=X.dtype),
+                          np.empty((X.shape[0], n), dtype=np.float32),
+                          np.empty(n, dtype=Y.dtype))
+        X_gather, X_batch, Y_batch = buffers[n]
+        np.take(X, batch, axis=1, out=X_gather, mode='clip')
+        np.take(Y, batch, out=Y_batch, mode='clip')
+        yield (normalize_batch(X_gather, out=X_batch), Y_batch)
 
 def random_mini_batches_orig(X, Y, mini_batch_size = 64, seed = 0):
     """
-    Creates a list of random minibatches from (X, Y)
+    Generates random minibatches from (X, Y)
 
     Arguments:
-    X -- input data, of shape (input size, number of examples)
-    Y -- true "label" vector (1 for blue dot / 0 for red dot), of shape (1, number of examples)
+    X -- input data, uint8 of shape (input size, number of examples)
+    Y -- true "label" vector, uint8 class indices of shape (number of examples,)
     mini_batch_size -- size of the mini-batches, integer
 
-    Returns:
-    mini_batches -- list of synchronous (mini_batch_X, mini_batch_Y)
+    Yields:
+    mini_batch -- synchronous (mini_batch_X, mini_batch_Y), mini_batch_X in float32
     """
 
     m = X.shape[1]                  # number of training examples
-    mini_batches = []
     np.random.seed(seed)
 
-    # Step 1: Shuffle (X, Y)
-    permutation = list(np.random.permutation(m))
-    shuffled_X = X[:, permutation]
-    shuffled_Y = Y[:, permutation].reshape((Y.shape[0],m))
+    # Step 1: Shuffle the indices of (X, Y)
+    permutation = np.random.permutation(m)
 
-    # Step 2: Partition (shuffled_X, shuffled_Y). Minus the end case.
+    # Step 2: Partition. Minus the end case.
     num_complete_minibatches = math.floor(m/mini_batch_size) # number of mini batches of size mini_batch_size in your partitionning
     for k in range(0, num_complete_minibatches):
-        mini_batch_X = shuffled_X[:, k * mini_batch_size : k * mini_batch_size + mini_batch_size]
-        mini_batch_Y = shuffled_Y[:, k * mini_batch_size : k * mini_batch_size + mini_batch_size]
-        mini_batch = (mini_batch_X, mini_batch_Y)
-        mini_batches.append(mini_batch)
+        batch = np.sort(permutation[k * mini_batch_size : k * mini_batch_size + mini_batch_size])
+        yield (normalize_batch(X[:, batch]), Y[batch])
 
     # Handling the end case (last mini-batch < mini_batch_size)
     if m % mini_batch_size != 0:
-        mini_batch_X = shuffled_X[:, num_complete_minibatches * mini_batch_size : m]
-        mini_batch_Y = shuffled_Y[:, num_complete_minibatches * mini_batch_size : m]
-        mini_batch = (mini_batch_X, mini_batch_Y)
-        mini_batches.append(mini_batch)
-
-    return mini_batches
+        batch = np.sort(permutation[num_complete_minibatches * mini_batch_size : m])
+        yield (normalize_batch(X[:, batch]), Y[batch])
 
-def one_hot_matrix(labels, C):
+def evaluate_in_batches(tensor, X, Y, X_set, Y_set, batch_size=1024):
     """
-    Creates a matrix where the i-th row corresponds to the ith class number and the jth column
-                     corresponds to the jth training example. So if example j had a label i. Then entry (i,j)
-                     will be 1.
-    Arguments:
-    labels -- vector containing the labels
-    C -- number of classes, the depth of the one hot dimension
-
-    Returns:
-    one_hot -- one hot matrix
+    Mean of tensor (e.g. the accuracy) over (X_set, Y_set) of shape (n_x, m) and (m,),
+    fed batch by batch so only one normalized batch is in memory at a time
     """
-    C = tf.constant(C, name='C')
-    one_hot_matrix = tf.one_hot(labels, C, axis=0)
-    sess = tf.Session()
-    one_hot = sess.run(one_hot_matrix)
-    sess.close()
+    m = X_set.shape[1]
+    total = 0.
+    for k in range(0, m, batch_size):
+        X_batch = normalize_batch(X_set[:, k : k + batch_size])
+        total += tensor.eval({X: X_batch, Y: Y_set[k : k + batch_size]}) * X_batch.shape[1]
 
-    return one_hot
+    return total / m
 
 def init_dataset_normalize():
-    train_df = pd.read_csv('dataset/fashion-mnist_train.csv')
-    test_df = pd.read_csv('dataset/fashion-mnist_test.csv')
-
-    Y_train_orig = train_df['label'].values[1:]
-    Y_test_orig = test_df['label'].values[1:]
-
-    Y_train = one_hot_matrix(Y_train_orig, 10)
-    Y_test = one_hot_matrix(Y_test_orig, 10)
+    """
+    Loads the train and test sets from the uint8 cache of load_dataset_cached,
+    the csv is only parsed the first time. X is uint8 of shape (784, m) and Y the
+    sparse uint8 class indices, of shape (m,).
+    """
+    peak_before = peak_rss()
+    X_train_orig, Y_train_orig = load_dataset_cached('dataset/fashion-mnist_train.csv')
+    X_test_orig, Y_test_orig = load_dataset_cached('dataset/fashion-mnist_test.csv')
 
-    X_train_orig = train_df.T[1:].T.values[1:].T
-    X_test_orig = test_df.T[1:].T.values[1:].T
+    Y_train = Y_train_orig
+    Y_test = Y_test_orig
 
-    X_train_flatten = X_train_orig
-    X_test_flatten = X_test_orig
+    # The images stay uint8, normalize_batch converts each minibatch when it is fed.
+    # A single contiguous uint8 copy in the (784, m) layout of the placeholders.
+    X_train = np.ascontiguousarray(X_train_orig.T)
+    X_test = np.ascontiguousarray(X_test_orig.T)
 
-    # Normalize image vectors
-    X_train = X_train_flatten/255.
-    X_test = X_test_flatten/255.
+    print('Dataset loaded: train', X_train.shape, 'test', X_test.shape, 'uint8,',
+          '%.1f MB, peak RSS %.1f MB (%.1f MB before loading)' % ((X_train.nbytes + X_test.nbytes) / 2.**20, peak_rss(), peak_before))
 
     return X_train, Y_train, X_test, Y_test
 
@@ -149,9 +294,15 @@ def flatternArrays(X_train_orig, X_test_orig):
     X_test_flatten = X_test_orig.reshape(X_test_orig.shape[0], -1).T
     return X_train_orig, X_test_orig
 
-def create_placeholders(n_x, n_y):
+def create_placeholders(n_x, defaults=None):
+    # class indices, the cost and the accuracy never need a one hot matrix
+    if defaults is not None:
+        # batch_method dataset: the graph reads the pipeline unless X and Y are fed
+        X = tf.placeholder_with_default(defaults[0], shape=[n_x, None], name='X')
+        Y = tf.placeholder_with_default(defaults[1], shape=[None], name='Y')
+        return X, Y
     X = tf.placeholder(tf.float32, shape=[n_x, None], name='X')
-    Y = tf.placeholder(tf.float32, shape=[n_y, None], name='Y')
+    Y = tf.placeholder(tf.int32, shape=[None], name='Y')
     return X, Y
 
 def init_parameters(n_x, n_h1, n_h2, n_h3, n_h4):
@@ -202,9 +353,9 @@ def foward_prop(X, parameters, keep_prob):
     return Z4
 
 def compute_cost(Z3, Y):
-    return tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits_v2(
+    return tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(
                 logits=tf.transpose(Z3),
-                labels=tf.transpose(Y)))
+                labels=Y))
 
 def model(X_train,
           Y_train,
@@ -221,17 +372,21 @@ def model(X_train,
           batch_method="experimental",
           thread_count=1,
           queue_capacity=100,
-          print_cost = True):
+          print_cost = True,
+          save_results = True):
 
     # tf.set_random_seed(1)                             # to keep consistent results
     ops.reset_default_graph()                         # to be able to rerun the model without overwriting tf variables
     seed = 3
     (n_x, m) = X_train.shape                          # (n_x: input size, m : number of examples in the train set)
-    n_y = Y_train.shape[0]                            # n_y : output size
     costs = []                                        # To keep track of the cost
 
-    # Create Placeholders of shape (n_x, n_y)
-    X, Y = create_placeholders(n_x, n_y)
+    # Create Placeholders of shape (n_x, None) and (None,)
+    if batch_method == 'dataset':
+        X_source, Y_source, iterator = dataset_mini_batches(n_x, minibatch_size, num_epochs, thread_count, queue_capacity, seed)
+        X, Y = create_placeholders(n_x, iterator.get_next())
+    else:
+        X, Y = create_placeholders(n_x)
     keep_prob = tf.constant(keep_probability, name='keep_prob')
 
     # Initialize parameters
@@ -263,6 +418,11 @@ def model(X_train,
             minibatch_queue = random_mini_batches_tf(X_train, Y_train, minibatch_size, thread_count, queue_capacity, seed)
             coord = tf.train.Coordinator()
             threads = tf.train.start_queue_runners(coord=coord)
+        if batch_method == 'prefetch':
+            prefetcher = MiniBatchPrefetcher(X_train, Y_train, num_epochs, minibatch_size, thread_count, queue_capacity, seed)
+        if batch_method == 'dataset':
+            sess.run(iterator.initializer, feed_dict={X_source: X_train.T, Y_source: Y_train})
+        training_start = time.time()
 
         # Do the training loop
         for epoch in range(num_epochs):
@@ -274,14 +434,21 @@ def model(X_train,
             if batch_method == 'experimental':
                 minibatches = random_mini_batches_exp(X_train, Y_train, minibatch_size, seed)
             if batch_method == 'basic':
-                minibatches = random_mini_batches(X_train, Y_train, minibatch_size, seed)
+                minibatches = random_mini_batches_orig(X_train, Y_train, minibatch_size, seed)
+            if batch_method == 'prefetch':
+                minibatches = prefetcher.epoch()
 
             #GET MINIBATCHES FROM QUEUE
             if batch_method == 'tensorflow':
                 for i in range(0, m, minibatch_size):
                     minibatch = sess.run(minibatch_queue)
                     minibatch_X, minibatch_Y = minibatch
-                    _ , minibatch_cost = sess.run([optimizer, cost], feed_dict={X: minibatch_X.T, Y: minibatch_Y.T})
+                    _ , minibatch_cost = sess.run([optimizer, cost], feed_dict={X: minibatch_X.T, Y: minibatch_Y})
+                    epoch_cost += minibatch_cost/num_minibatches
+            elif batch_method == 'dataset':
+                # the minibatch comes from the pipeline inside the graph
+                for i in range(0, m, minibatch_size):
+                    _ , minibatch_cost = sess.run([optimizer, cost])
                     epoch_cost += minibatch_cost/num_minibatches
             else:
                 for minibatch in minibatches:
@@ -300,29 +467,55 @@ def model(X_train,
         if batch_method == 'tensorflow':
             coord.request_stop()
             coord.join(threads)
-
-        # plot the cost
-        plt.plot(np.squeeze(costs))
-        plt.ylabel('cost')
-        plt.xlabel('iterations (per tens)')
-        plt.title("Learning rate =" + str(learning_rate))
-        plt.savefig('./cost_function_graph/COST_FUNCTION_'+datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S'))
+        training_time = time.time() - training_start
+        examples_per_second = num_epochs * m / training_time
+        print('THROUGHPUT: %.0f examples/s (%.2f s of training)' % (examples_per_second, training_time))
+        if batch_method == 'prefetch':
+            prefetcher.close()
+            print('DATA WAIT: %.2f s of %.2f s of training (%.1f%%)' % (prefetcher.wait_time, training_time, 100 * prefetcher.wait_time / training_time))
 
         # lets save the parameters in a variable
         parameters = sess.run(parameters)
         print ("Parameters have been trained!")
-        saveParams(parameters)
+
+        if save_results:
+            # plot the cost
+            plt.plot(np.squeeze(costs))
+            plt.ylabel('cost')
+            plt.xlabel('iterations (per tens)')
+            plt.title("Learning rate =" + str(learning_rate))
+            plt.savefig('./cost_function_graph/COST_FUNCTION_'+datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S'))
+            saveParams(parameters)
 
         # Calculate the correct predictions
-        correct_prediction = tf.equal(tf.argmax(Z3), tf.argmax(Y))
+        correct_prediction = tf.equal(tf.argmax(Z3), tf.cast(Y, tf.int64))
 
         # Calculate accuracy on the test set
         accuracy = tf.reduce_mean(tf.cast(correct_prediction, "float"))
 
-        print ("Train Accuracy:", accuracy.eval({X: X_train, Y: Y_train}))
-        print ("Test Accuracy:", accuracy.eval({X: X_test, Y: Y_test}))
+        print ("Train Accuracy:", evaluate_in_batches(accuracy, X, Y, X_train, Y_train))
+        print ("Test Accuracy:", evaluate_in_batches(accuracy, X, Y, X_test, Y_test))
+
+        return parameters, examples_per_second
+
+def compare_batch_methods(X_train, Y_train, X_test, Y_test, batch_methods=BATCH_METHODS, **kwargs):
+    """
+    Trains the same model with every batch method and prints their throughput,
+    relative to the first one. kwargs are the arguments of model (num_epochs,
+    minibatch_size, thread_count...); the cost graphs and the parameters are not saved.
+    """
+    throughputs = []
+    for batch_method in batch_methods:
+        print('[BATCH METHOD ' + batch_method + ']')
+        parameters, examples_per_second = model(X_train, Y_train, X_test, Y_test, batch_method=batch_method,
+                                                print_cost=False, save_results=False, **kwargs)
+        throughputs.append(examples_per_second)
 
-        return parameters
+    print('%-14s %14s %8s' % ('BATCH METHOD', 'EXAMPLES/S', 'SPEEDUP'))
+    for batch_method, examples_per_second in zip(batch_methods, throughputs):
+        print('%-14s %14.0f %7.2fx' % (batch_method, examples_per_second, examples_per_second / throughputs[0]))
+
+    return dict(zip(batch_methods, throughputs))
 
 def predict(X, parameters):
 
@@ -448,13 +641,14 @@ def saveConfig(configDict):
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--batch_method', help='method used to make the mini batches', default = 'experimental')
+    parser.add_argument('--batch_method', help='method used to make the mini batches: basic, experimental, tensorflow, prefetch or dataset', default = 'experimental')
+    parser.add_argument('--compare_batch_methods', help='train with every batch method for epoch epochs and compare their throughput', action='store_true')
     parser.add_argument('--learning_rate', help='learning rate for the algorithm', default=0.001)
     parser.add_argument('--batch_size', help='size of mini batches', default=32)
     parser.add_argument('--keep_prob', help='probability of keeping the neuron in the dropout method', default=0.8)
     parser.add_argument('--epoch', help='iteration number', default=1500)
-    parser.add_argument('--thread_count', help='This is only for batch method tensorflow', default=2)
-    parser.add_argument('--queue_capacity', help='This is only for batch method tensorflow, indicate the queue capacity of the batches', default=100)
+    parser.add_argument('--thread_count', help='This is only for batch methods tensorflow, prefetch and dataset, number of threads making the batches', default=2)
+    parser.add_argument('--queue_capacity', help='This is only for batch methods tensorflow, prefetch and dataset, indicate the queue capacity of the batches', default=100)
     parser.add_argument('--L1', help='The size of hidden layer 1', default=50)
     parser.add_argument('--L2', help='The size of hidden layer 2', default=25)
     parser.add_argument('--L3', help='The size of hidden layer 3', default=12)
@@ -502,12 +696,29 @@ def main():
     print('L2:', L2)
     print('L3:', L3)
     print('L4:', L4)
-    if(batch_method=='tensorflow'):
+    if(batch_method in ('tensorflow', 'prefetch', 'dataset')):
         print('NUM THREADS:', thread_count)
         print('QUEUE CAPACITY:', queue_capacity)
 
     X_train, Y_train, X_test, Y_test = init_dataset_normalize()
-    parameters = model(X_train,
+    if args.compare_batch_methods:
+        compare_batch_methods(X_train,
+              Y_train,
+              X_test,
+              Y_test,
+              learning_rate = learning_rate,
+              num_epochs = epoch,
+              minibatch_size = batch_size,
+              keep_probability=keep_prob,
+              L1=L1,
+              L2=L2,
+              L3=L3,
+              L4=L4,
+              thread_count=thread_count,
+              queue_capacity=queue_capacity)
+        return
+
+    parameters, examples_per_second = model(X_train,
               Y_train,
               X_test,
               Y_test,
@@ -555,9 +766,9 @@ def image_test():
     parameters = readParams()
 
     print(X_test.shape)
-    image = X_test[:, 5000].reshape(X_test.shape[0], 1)
+    image = normalize_batch(X_test[:, 5000].reshape(X_test.shape[0], 1))
     print(image.shape)
-    print("LABEL: ", Y_test[:, 5000])
+    print("LABEL: ", Y_test[5000])
 
     my_image_prediction, probabilities, zn = predict(image, parameters)
 